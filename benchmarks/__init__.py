@@ -0,0 +1,12 @@
+'''
+Benchmarks of the hooks of taskwarrior and the extensions of timewarrior on
+synthetic data, run against fake `task`, `timew` and `taskopen` commands.
+
+    python3 -m benchmarks.run --scales 1000,10000,100000 -o results.json
+    python3 -m benchmarks.run --compare results.json
+    python3 -m benchmarks.startup
+
+Every run records its wall time, peak RSS and the number of commands it
+spawned, so that results can be compared between commits. The startup check
+fails when a hook or extension takes longer than its budget to start.
+'''
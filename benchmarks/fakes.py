@@ -0,0 +1,84 @@
+'''
+Fake `task`, `timew` and `taskopen` commands answering from the dataset of
+benchmarks.generate. Each call is appended to `calls.log` under the root of
+the dataset, which is how the spawned commands are counted.
+'''
+
+import os
+import sys
+
+
+TASK = '''
+import os, sys, json
+
+root = os.environ['BENCH_ROOT']
+with open(os.path.join(root, 'calls.log'), 'a') as f:
+    f.write('task %s\\n' % ' '.join(sys.argv[1:]))
+path = os.path.join(root, 'tasks.json')
+with open(path) as f:
+    tasks = json.load(f)
+args = [a for a in sys.argv[1:] if not a.startswith('rc.')]
+if args[:1] == ['import']:
+    byuuid = {t['uuid']: t for t in tasks}
+    for line in sys.stdin:
+        if line.strip():
+            task = json.loads(line)
+            byuuid[task['uuid']] = task
+    with open(path, 'w') as f:
+        json.dump(list(byuuid.values()), f)
+elif args[-1:] == ['export']:
+    ids = set(args[:-1])
+    print('[\\n' + ',\\n'.join(
+        json.dumps(t) for t in tasks
+        if not ids or t['uuid'] in ids or str(t['id']) in ids) + '\\n]')
+elif args[:1] == ['_get']:
+    byid = {str(t['id']): t for t in tasks}
+    byid.update((t['uuid'], t) for t in tasks)
+    values = []
+    for arg in args[1:]:
+        _id, attr = arg.split('.', 1)
+        value = byid[_id].get(attr, '')
+        values.append(','.join(value) if isinstance(value, list) else value)
+    print(' '.join(map(str, values)))
+'''
+
+TIMEW = '''
+import os, sys, json
+
+root = os.environ['BENCH_ROOT']
+with open(os.path.join(root, 'calls.log'), 'a') as f:
+    f.write('timew %s\\n' % ' '.join(sys.argv[1:]))
+args = sys.argv[1:]
+if args[:1] == ['export'] or args[:2] == ['get', 'dom.tracked.1.json']:
+    with open(os.path.join(root, 'intervals.json')) as f:
+        entries = json.load(f)
+    if args[0] == 'export':
+        print('[\\n' + ',\\n'.join(json.dumps(e) for e in entries) + '\\n]')
+    elif entries:
+        print(json.dumps(entries[-1]))
+'''
+
+TASKOPEN = '''#!/bin/sh
+echo "taskopen $*" >> "$BENCH_ROOT/calls.log"
+'''
+
+
+def install(bindir):
+    '''Write the fake commands into `bindir`, to be put first in PATH'''
+    os.makedirs(bindir, exist_ok=True)
+    for name, source in (
+            ('task', TASK), ('timew', TIMEW), ('taskopen', TASKOPEN)):
+        if not source.startswith('#!'):
+            source = '#!%s\n%s' % (sys.executable, source)
+        path = os.path.join(bindir, name)
+        with open(path, 'w') as f:
+            f.write(source)
+        os.chmod(path, 0o755)
+
+
+def count_calls(root):
+    try:
+        with open(os.path.join(root, 'calls.log')) as f:
+            return sum(1 for line in f)
+    except FileNotFoundError:
+        return 0
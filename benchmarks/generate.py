@@ -0,0 +1,163 @@
+'''
+Seeded generator of tasks and intervals which look like real ones: tasks in
+dotted projects, and intervals tagged like `task <id> timew start` does, most
+of them in Pomodoro Mode.
+
+    python3 -m benchmarks.generate --seed 1 --intervals 1000 /tmp/dataset
+'''
+
+import os
+import json
+import time
+import uuid
+import random
+import argparse
+import calendar
+
+import settings
+
+
+# The data starts here, so that the same seed always gives the same data.
+BASE_EPOCH = calendar.timegm((2020, 1, 1, 0, 0, 0))
+PROJECT_NAMES = (
+    'work', 'home', 'study', 'api', 'web', 'docs', 'ops', 'math', 'garden',
+    'reading', 'v1', 'v2')
+DURATIONS = (1500, 1500, 1500, 1000, 1800, 60)
+GAPS = (0, 0, 60, 200, 300, 300, 900, 2000)
+IMPORTED = '20190101T000000Z'
+
+
+def format_epoch(epoch):
+    return '%04d%02d%02dT%02d%02d%02dZ' % time.gmtime(epoch)[:6]
+
+
+def projects(rng, count):
+    '''`count` dotted projects, nested up to 3 levels'''
+    ret = []
+    while len(ret) < count:
+        parent = rng.choice(ret) if ret and rng.random() < 0.6 else None
+        name = rng.choice(PROJECT_NAMES)
+        project = '%s.%s' % (parent, name) if parent else name
+        if project not in ret and project.count('.') < 3:
+            ret.append(project)
+    return ret
+
+
+def tasks(rng, count):
+    '''Tasks like `task export` prints'''
+    ret = []
+    candidates = projects(rng, max(1, count // 8))
+    for i in range(count):
+        task = {
+            'id': 0,
+            'description': 'Task number %d' % (i + 1),
+            'entry': IMPORTED,
+            'modified': IMPORTED,
+            'status': 'completed' if rng.random() < 0.3 else 'pending',
+            'uuid': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            'urgency': 0,
+        }
+        if rng.random() < 0.9:
+            task['project'] = rng.choice(candidates)
+        if rng.random() < 0.3:
+            task['tags'] = ['next']
+        ret.append(task)
+    for i, task in enumerate(t for t in ret if t['status'] == 'pending'):
+        task['id'] = i + 1
+    return ret
+
+
+def intervals(rng, tasks, count, opened=True):
+    '''Intervals like `timew export` prints, with the last one open'''
+    ret, t = [], BASE_EPOCH
+    for i in range(count):
+        task = rng.choice(tasks)
+        tags = [settings.POMODORO_TAG] if rng.random() < 0.8 else []
+        project = task.get('project')
+        while project:
+            tags.append(project)
+            project = project.rpartition('.')[0]
+        tags.append(task['uuid'])
+        start, t = t, t + rng.choice(DURATIONS)
+        ret.append({
+            'id': count - i,
+            'start': format_epoch(start),
+            'end': format_epoch(t),
+            'tags': tags,
+        })
+        t += rng.choice(GAPS)
+    if opened and ret:
+        ret[-1].pop('end')
+    return ret
+
+
+def generate(seed, interval_count, task_count=None):
+    rng = random.Random(seed)
+    ts = tasks(rng, task_count or max(20, interval_count // 20))
+    return ts, intervals(rng, ts, interval_count)
+
+
+def format_tags(tags):
+    return ' '.join(
+        '"%s"' % t.replace('"', '\\"') if ' ' in t or '"' in t else t
+        for t in tags)
+
+
+def write_data(entries, datadir):
+    '''Write `entries` into the monthly data files of timewarrior'''
+    os.makedirs(datadir, exist_ok=True)
+    files = {}
+    try:
+        for entry in entries:
+            month = '%s-%s.data' % (entry['start'][:4], entry['start'][4:6])
+            if month not in files:
+                files[month] = open(os.path.join(datadir, month), 'w')
+            line = 'inc ' + entry['start']
+            if 'end' in entry:
+                line += ' - ' + entry['end']
+            if entry['tags']:
+                line += ' # ' + format_tags(entry['tags'])
+            files[month].write(line + '\n')
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def extension_input(entries, configs=None):
+    '''What timewarrior feeds extensions: configs, a blank line and JSON'''
+    configs = dict(configs or {})
+    if entries:
+        configs.setdefault('temp.report.start', entries[0]['start'])
+        configs.setdefault(
+            'temp.report.end', entries[-1].get('end', entries[-1]['start']))
+    return ''.join('%s: %s\n' % kv for kv in sorted(configs.items())) + (
+        '\n' + json.dumps(entries))
+
+
+def write_dataset(root, seed, interval_count, task_count=None):
+    '''
+    Write the tasks and intervals under `root`, where the fake commands and
+    timewarrior look for them
+    '''
+    ts, entries = generate(seed, interval_count, task_count)
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, 'tasks.json'), 'w') as f:
+        json.dump(ts, f)
+    with open(os.path.join(root, 'intervals.json'), 'w') as f:
+        json.dump(entries, f)
+    write_data(entries, os.path.join(root, 'timewarrior', 'data'))
+    return ts, entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('root')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--intervals', type=int, default=1000)
+    parser.add_argument('--tasks', type=int)
+    args = parser.parse_args()
+    write_dataset(args.root, args.seed, args.intervals, args.tasks)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+'''
+Run the extensions of timewarrior and the hooks of taskwarrior on synthetic
+datasets and print the results as JSON.
+
+    python3 -m benchmarks.run --scales 1000,10000 -o results.json
+    python3 -m benchmarks.run --scales 1000 --compare results.json
+
+Each target is run with an empty cache first, then again with the cache it
+left behind.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import subprocess
+
+from benchmarks import fakes, generate
+
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXTENSIONS = os.path.join(BASEDIR, 'timewarrior', 'extensions')
+HOOKS = os.path.join(BASEDIR, 'taskwarrior', 'hooks')
+SCALES = (1000, 10000, 100000)
+
+# (name, script, configs fed before the intervals)
+EXTENSION_TARGETS = (
+    ('duration', 'duration.py', {}),
+    ('pomo_stat', 'pomo_stat.py', {}),
+    ('pomo_msg', 'pomo_msg.py', {}),
+    ('project', 'project.py', {}),
+    ('project tree', 'project.py', {'reports.project.tree': 'on'}),
+    ('task', 'task.py', {}),
+)
+
+
+def hook_args(args, command):
+    return [
+        'api:2', 'args:' + args, 'command:' + command,
+        'rc:~/.taskrc', 'data:~/.task', 'version:2.6.2']
+
+
+def hook_targets(tasks):
+    '''(name, script, argv, stdin) of hooks as taskwarrior calls them'''
+    task = next(
+        t for t in tasks if t['status'] == 'pending' and 'project' in t)
+    added = dict(task, uuid='00000000-0000-4000-8000-000000000000')
+    started = dict(task, start=generate.IMPORTED)
+    done = dict(started, status='completed', end=generate.IMPORTED)
+    split = 'task %s split first part , second part +next' % task['id']
+    return (
+        ('on-add', 'on-add.py',
+         hook_args('task add %s' % task['description'], 'add'),
+         json.dumps(added) + '\n'),
+        ('on-modify done', 'on-modify.py',
+         hook_args('task %s done' % task['id'], 'done'),
+         json.dumps(started) + '\n' + json.dumps(done) + '\n'),
+        ('on-exit split', 'on-exit.py', hook_args(split, 'split'), ''),
+    )
+
+
+class Bench:
+    '''A dataset and the environment in which targets run against it'''
+
+    def __init__(self, root, seed, scale):
+        self.root, self.scale = root, scale
+        self.tasks, self.entries = generate.write_dataset(root, seed, scale)
+        fakes.install(os.path.join(root, 'bin'))
+        self.env = dict(
+            os.environ,
+            HOME=os.path.join(root, 'home'),
+            TIMEWARRIORDB=os.path.join(root, 'timewarrior'),
+            POMODORO_SOCKET=os.path.join(root, 'pomo.sock'),
+            BENCH_ROOT=root,
+            PATH=os.path.join(root, 'bin') + os.pathsep + os.environ['PATH'])
+        os.makedirs(self.env['HOME'], exist_ok=True)
+
+    def clear_cache(self):
+        shutil.rmtree(
+            os.path.join(self.env['HOME'], '.cache'), ignore_errors=True)
+
+    def measure(self, argv, stdin, cwd):
+        '''Wall time, peak RSS and commands spawned of a single run'''
+        # Hooks like `split` change the tasks, so each run starts the same.
+        with open(os.path.join(self.root, 'tasks.json'), 'w') as f:
+            json.dump(self.tasks, f)
+        calls = fakes.count_calls(self.root)
+        with tempfile.TemporaryFile('w+') as f:
+            f.write(stdin)
+            f.seek(0)
+            start = time.perf_counter()
+            proc = subprocess.Popen(
+                argv, stdin=f, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL, cwd=cwd, env=self.env)
+            _, status, rusage = os.wait4(proc.pid, 0)
+            wall = time.perf_counter() - start
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        return {
+            'wall': round(wall, 4),
+            'max_rss_kb': rusage.ru_maxrss,
+            'spawns': fakes.count_calls(self.root) - calls,
+            'returncode': proc.returncode,
+        }
+
+    def targets(self):
+        for name, script, configs in EXTENSION_TARGETS:
+            yield (
+                'extension/' + name, EXTENSIONS,
+                [sys.executable, os.path.join(EXTENSIONS, script)],
+                generate.extension_input(self.entries, configs))
+        for name, script, argv, stdin in hook_targets(self.tasks):
+            yield (
+                'hook/' + name, HOOKS,
+                [sys.executable, os.path.join(HOOKS, script)] + argv, stdin)
+
+    def run(self, only=None):
+        for name, cwd, argv, stdin in self.targets():
+            if only and not any(o in name for o in only):
+                continue
+            self.clear_cache()
+            for cache in ('cold', 'warm'):
+                result = {'name': name, 'scale': self.scale, 'cache': cache}
+                result.update(self.measure(argv, stdin, cwd))
+                print(json.dumps(result), file=sys.stderr)
+                yield result
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASEDIR,
+            encoding='utf-8', stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    '''Print the ratios of `results` to those of `baseline`'''
+    key = lambda r: (r['name'], r['scale'], r['cache'])
+    old = {key(r): r for r in baseline['results']}
+    print('%-28s %7s %5s %8s %8s %8s' % (
+        'target', 'scale', 'cache', 'wall', 'rss', 'spawns'))
+    for r in results['results']:
+        o = old.get(key(r))
+        if not o:
+            continue
+        print('%-28s %7d %5s %7.2fx %7.2fx %+8d' % (
+            r['name'], r['scale'], r['cache'],
+            r['wall'] / (o['wall'] or 1e-9),
+            r['max_rss_kb'] / (o['max_rss_kb'] or 1),
+            r['spawns'] - o['spawns']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--scales', default=','.join(map(str, SCALES)),
+        help='numbers of intervals, separated by commas')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument(
+        '--only', action='append', help='run only targets matching this')
+    parser.add_argument('-o', '--output', help='write the results here')
+    parser.add_argument('--compare', help='results to compare with')
+    args = parser.parse_args()
+
+    results = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'results': [],
+    }
+    with tempfile.TemporaryDirectory(prefix='pomodoro-bench-') as tmpdir:
+        for scale in map(int, args.scales.split(',')):
+            bench = Bench(os.path.join(tmpdir, str(scale)), args.seed, scale)
+            results['results'].extend(bench.run(args.only))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    elif not args.output:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
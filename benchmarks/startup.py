@@ -0,0 +1,78 @@
+'''
+Check that the hooks and extensions start within their budget, in the
+cases which run on every command of taskwarrior or refresh of a status-line.
+
+    python3 -m benchmarks.startup
+
+The budget is in milliseconds on top of starting a bare interpreter, and the
+median of several runs is compared with it. Exits with 1 when over budget.
+'''
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+
+from benchmarks import generate
+from benchmarks.run import Bench, EXTENSIONS, HOOKS, hook_args
+
+
+BUDGET_MS = 40
+
+
+def targets(bench):
+    '''(name, cwd, argv, stdin) of runs which have nothing to do'''
+    task = bench.tasks[0]
+    modified = dict(task, modified=generate.IMPORTED)
+    yield (
+        'hook/on-add', HOOKS,
+        [sys.executable, os.path.join(HOOKS, 'on-add.py')] +
+        hook_args('task add x', 'add'), json.dumps(task) + '\n')
+    for script in ('on-modify.py', 'on-modify.01-aw-watcher-taskwarrior.py'):
+        yield (
+            'hook/' + script[:-3], HOOKS,
+            [sys.executable, os.path.join(HOOKS, script)] +
+            hook_args('task 1 modify x', 'modify'),
+            json.dumps(task) + '\n' + json.dumps(modified) + '\n')
+    yield (
+        'hook/on-exit', HOOKS,
+        [sys.executable, os.path.join(HOOKS, 'on-exit.py')] +
+        hook_args('task list', 'list'), '')
+    for script in ('pomo_msg.py', 'duration.py'):
+        yield (
+            'extension/' + script[:-3], EXTENSIONS,
+            [sys.executable, os.path.join(EXTENSIONS, script)],
+            generate.extension_input([]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget', type=float, default=BUDGET_MS)
+    args = parser.parse_args()
+
+    over = False
+    with tempfile.TemporaryDirectory(prefix='pomodoro-startup-') as tmpdir:
+        bench = Bench(tmpdir, 1, 10)
+
+        def median(argv, stdin, cwd):
+            return statistics.median(
+                bench.measure(argv, stdin, cwd)['wall'] * 1000
+                for i in range(args.runs))
+
+        bare = median([sys.executable, '-c', 'pass'], '', tmpdir)
+        print('%-44s %7.1f ms' % ('python', bare))
+        for name, cwd, argv, stdin in targets(bench):
+            # The first run fills the caches, like any run before did.
+            bench.measure(argv, stdin, cwd)
+            ms = median(argv, stdin, cwd) - bare
+            over = over or ms > args.budget
+            print('%-44s %+7.1f ms%s' % (
+                name, ms, '  OVER BUDGET' if ms > args.budget else ''))
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+'''
+A SQLite cache shared by the hooks of taskwarrior and the extensions of
+timewarrior, so that reports don't have to ask `task` for every task again.
+
+The hooks keep it up to date whenever a task is added or modified. Tasks
+changed otherwise, as by `task sync` or by another host sharing the data of
+taskwarrior, are told by the data files of taskwarrior having changed.
+'''
+
+import os
+
+import settings
+
+
+# Enough for the reports. Everything else is asked from `task` directly.
+TASK_FIELDS = ('description', 'project', 'status', 'tags')
+# SQLite limits the number of host parameters in a statement.
+MAX_VARIABLES = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cached_tasks (
+    uuid TEXT PRIMARY KEY,
+    generation INTEGER,
+    description TEXT,
+    project TEXT,
+    status TEXT,
+    tags TEXT
+);
+CREATE TABLE IF NOT EXISTS task_files (
+    signature TEXT PRIMARY KEY,
+    generation INTEGER
+);
+CREATE TABLE IF NOT EXISTS jrnl_logs (
+    uuid TEXT,
+    since TEXT,
+    until TEXT,
+    logs TEXT,
+    PRIMARY KEY (uuid, since, until)
+);
+CREATE TABLE IF NOT EXISTS tracked_seconds (
+    uuid TEXT,
+    month TEXT,
+    seconds INTEGER,
+    PRIMARY KEY (uuid, month)
+);
+CREATE TABLE IF NOT EXISTS tracked_months (
+    month TEXT PRIMARY KEY,
+    last INTEGER,
+    signature TEXT,
+    digest TEXT
+);
+CREATE TABLE IF NOT EXISTS rollup_days (
+    day TEXT PRIMARY KEY,
+    signature TEXT
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    day TEXT,
+    uuid TEXT,
+    seconds INTEGER,
+    pomodoro_seconds INTEGER,
+    PRIMARY KEY (day, uuid)
+);
+-- Left by the TaskCache kept without generations.
+DROP TABLE IF EXISTS tasks;
+-- Left by the TrackedIndex kept without months.
+DROP TABLE IF EXISTS tracked;
+DROP TABLE IF EXISTS marks;
+'''
+
+
+def connect():
+    import sqlite3
+
+    os.makedirs(settings.CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(
+        os.path.join(settings.CACHE_DIR, 'cache.sqlite3'), timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def task_data_location():
+    '''Where taskwarrior keeps its data, as TASKDATA or the taskrc tells'''
+    location = os.getenv('TASKDATA')
+    if location:
+        return os.path.expanduser(location)
+    location = '~/.task'
+    try:
+        with open(os.getenv('TASKRC') or os.path.expanduser('~/.taskrc')) as f:
+            for line in f:
+                key, sep, value = line.partition('=')
+                if sep and key.strip() == 'data.location':
+                    location = value.strip()
+    except OSError:
+        pass
+    return os.path.expanduser(location)
+
+
+def task_data_signature(location=None):
+    '''The mtimes and sizes of the files taskwarrior keeps the tasks in'''
+    location = os.path.expanduser(location or task_data_location())
+    states = []
+    for name in ('pending.data', 'completed.data', 'taskchampion.sqlite3'):
+        try:
+            st = os.stat(os.path.join(location, name))
+            states.append('%d:%d' % (st.st_mtime_ns, st.st_size))
+        except OSError:
+            states.append('')
+    return ','.join(states)
+
+
+class TaskCache:
+    '''
+    Tasks by uuid, cached as of a generation of the data files of
+    taskwarrior. A new generation starts whenever the data files are found
+    changed, so that the tasks cached before are exported again.
+    '''
+
+    def __init__(self, conn=None):
+        self.conn = conn or connect()
+
+    def generation(self, signature):
+        '''The generation of the data files of taskwarrior in `signature`'''
+        with self.conn:
+            row = self.conn.execute(
+                'SELECT generation FROM task_files WHERE signature = ?',
+                (signature,)).fetchone()
+            if row:
+                return row[0]
+            generation = self.conn.execute(
+                'SELECT MAX(generation) FROM task_files').fetchone()[0]
+            generation = (generation or 0) + 1
+            self.conn.execute('DELETE FROM task_files')
+            self.conn.execute(
+                'INSERT INTO task_files VALUES (?, ?)',
+                (signature, generation))
+        return generation
+
+    def carry(self, old, new):
+        '''
+        Keep the tasks cached as of the data files in signature `old` as of
+        the ones in signature `new`, as all their changes were cached
+        '''
+        with self.conn:
+            self.conn.execute(
+                'UPDATE task_files SET signature = ? WHERE signature = ?',
+                (new, old))
+
+    def get(self, uuids, generation):
+        '''
+        Map the ones of `uuids` cached as of `generation` to tasks like
+        `task export` does
+        '''
+        uuids, tasks = list(uuids), {}
+        for i in range(0, len(uuids), MAX_VARIABLES):
+            chunk = uuids[i:i + MAX_VARIABLES]
+            rows = self.conn.execute(
+                'SELECT uuid, %s FROM cached_tasks '
+                'WHERE generation = ? AND uuid IN (%s)' % (
+                    ', '.join(TASK_FIELDS), ', '.join('?' * len(chunk))),
+                [generation] + chunk)
+            for row in rows:
+                task = {'uuid': row[0]}
+                for k, v in zip(TASK_FIELDS, row[1:]):
+                    if v:
+                        task[k] = v.split(',') if k == 'tags' else v
+                tasks[row[0]] = task
+        return tasks
+
+    def put(self, tasks, generation):
+        with self.conn:
+            self.conn.executemany(
+                'REPLACE INTO cached_tasks VALUES (?, ?, %s)' % (
+                    ', '.join('?' * len(TASK_FIELDS))),
+                (
+                    [task['uuid'], generation] + [
+                        ','.join(task.get(k, ())) if k == 'tags'
+                        else task.get(k)
+                        for k in TASK_FIELDS
+                    ]
+                    for task in tasks
+                ))
+
+
+class JrnlCache:
+    '''Logs of jrnl keyed by (uuid, from, to), with '' for no logs'''
+
+    def __init__(self, conn=None):
+        self.conn = conn or connect()
+
+    def get(self, key):
+        row = self.conn.execute(
+            'SELECT logs FROM jrnl_logs '
+            'WHERE uuid = ? AND since = ? AND until = ?', key).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, logs):
+        with self.conn:
+            self.conn.execute(
+                'REPLACE INTO jrnl_logs VALUES (?, ?, ?, ?)', key + (logs,))
+
+
+class TrackedIndex:
+    '''
+    Seconds tracked for every task by month of the data files of timewarrior,
+    folded in from the closed intervals which started after the last one
+    folded in before. Every month keeps the start of its last interval
+    folded in, along with the signature and digest of its data file then.
+    '''
+
+    def __init__(self, conn=None):
+        self.conn = conn or connect()
+
+    def watermark(self):
+        '''Start of the last interval folded in, in seconds since the epoch'''
+        return self.conn.execute(
+            'SELECT MAX(last) FROM tracked_months').fetchone()[0]
+
+    def months(self):
+        '''Map the months folded in to the (signature, digest) of their file'''
+        return {
+            month: (signature, digest)
+            for month, signature, digest in self.conn.execute(
+                'SELECT month, signature, digest FROM tracked_months')}
+
+    def fold(self, intervals, reset=()):
+        '''
+        Fold in the closed `intervals` as (start, end, uuid) in order, after
+        clearing the months in `reset`, which are folded in again whole.
+        Return the months folded in.
+        '''
+        import time
+        import collections
+
+        watermark = self.watermark()
+        seconds, last = collections.Counter(), {}
+        for start, end, uuid in intervals:
+            month = time.strftime('%Y-%m', time.gmtime(start))
+            if (month not in reset and watermark is not None and
+                    start <= watermark):
+                continue
+            if uuid:
+                seconds[uuid, month] += end - start
+            last[month] = start
+        if not (reset or last):
+            return set()
+        with self.conn:
+            self.conn.executemany(
+                'DELETE FROM tracked_seconds WHERE month = ?',
+                ((month,) for month in reset))
+            self.conn.executemany(
+                'UPDATE tracked_months SET last = NULL WHERE month = ?',
+                ((month,) for month in reset))
+            self.conn.executemany(
+                'INSERT INTO tracked_seconds VALUES (?, ?, ?) '
+                'ON CONFLICT (uuid, month) '
+                'DO UPDATE SET seconds = seconds + excluded.seconds',
+                (key + (n,) for key, n in seconds.items()))
+            self.conn.executemany(
+                'INSERT INTO tracked_months (month, last) VALUES (?, ?) '
+                'ON CONFLICT (month) DO UPDATE SET last = excluded.last',
+                last.items())
+        return set(reset).union(last)
+
+    def keep(self, months):
+        '''
+        Keep the (signature, digest) of the files of `months`, forgetting
+        the months mapped to None
+        '''
+        with self.conn:
+            for month, state in months.items():
+                if state is None:
+                    self.conn.execute(
+                        'DELETE FROM tracked_seconds WHERE month = ?',
+                        (month,))
+                    self.conn.execute(
+                        'DELETE FROM tracked_months WHERE month = ?', (month,))
+                else:
+                    self.conn.execute(
+                        'INSERT INTO tracked_months VALUES (?, NULL, ?, ?) '
+                        'ON CONFLICT (month) DO UPDATE SET '
+                        'signature = excluded.signature, '
+                        'digest = excluded.digest',
+                        (month,) + state)
+
+    def seconds(self, uuid):
+        row = self.conn.execute(
+            'SELECT SUM(seconds) FROM tracked_seconds WHERE uuid = ?',
+            (uuid,)).fetchone()
+        return row[0] or 0
+
+
+class RollupCache:
+    '''
+    Seconds tracked for every task by local day, and the ones of them in
+    Pomodoro Mode, with the signature of the data files they are summed up
+    from. Intervals without a uuid count for the uuid ''.
+    '''
+
+    def __init__(self, conn=None):
+        self.conn = conn or connect()
+
+    def select(self, sql, days):
+        days = list(days)
+        for i in range(0, len(days), MAX_VARIABLES):
+            chunk = days[i:i + MAX_VARIABLES]
+            yield from self.conn.execute(
+                sql % ', '.join('?' * len(chunk)), chunk)
+
+    def signatures(self, days):
+        return dict(self.select(
+            'SELECT day, signature FROM rollup_days WHERE day IN (%s)', days))
+
+    def get(self, days):
+        '''(day, uuid, seconds, pomodoro_seconds) of the `days`'''
+        return list(self.select(
+            'SELECT day, uuid, seconds, pomodoro_seconds FROM rollups '
+            'WHERE day IN (%s)', days))
+
+    def put(self, days):
+        '''
+        Replace the days in `days`, mapping them to their signature and
+        (uuid, seconds, pomodoro_seconds) of their tasks
+        '''
+        with self.conn:
+            self.conn.executemany(
+                'DELETE FROM rollups WHERE day = ?', ((d,) for d in days))
+            self.conn.executemany(
+                'REPLACE INTO rollup_days VALUES (?, ?)',
+                ((d, signature) for d, (signature, _) in days.items()))
+            self.conn.executemany(
+                'INSERT INTO rollups VALUES (?, ?, ?, ?)',
+                (
+                    (d,) + tuple(row)
+                    for d, (_, rows) in days.items() for row in rows
+                ))
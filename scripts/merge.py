@@ -0,0 +1,200 @@
+'''
+Merge the data of timewarrior kept by several hosts into one.
+
+When the data folder is shared through cloud storage, every host writes its
+own copies of the month files, and the sync leaves conflicted copies and
+intervals tracked twice. This script takes the data folders of the hosts,
+merges their month files by the start of the intervals and writes them
+consolidated into one data folder.
+
+    python3 merge.py -o OUTPUT DATA [DATA ...]
+
+A data folder is the `data` folder of timewarrior or a folder holding it.
+Files like `2018-01 (conflicted copy).data` count as copies of 2018-01.data,
+and the ones merged from the output folder are removed from it afterwards.
+Only one month of every host is held in memory at a time.
+
+Duplicates are resolved the same way whatever the order of hosts is:
+
+* Intervals are ordered by start, then by end, then by tags.
+* Intervals with the same tags overlapping each other are copies of one
+  interval, and are joined into one. An open interval is closed by the
+  end of a closed copy.
+* Otherwise an open interval ends where the next one starts, and intervals
+  overlapping the one before are cut to start at its end, or dropped if
+  they are within it.
+'''
+
+import os
+import re
+import sys
+import heapq
+import argparse
+import tempfile
+import collections
+
+sys.path.append(os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    'timewarrior', 'extensions'))
+from utils import DATA_FILE_PATTERN, DATA_LINE_PATTERN
+
+
+MONTH_FILE_PATTERN = re.compile(r'^(\d{4}-\d\d)\b.*\.data$')
+# Sorts after the end of any closed interval.
+OPEN_END = '~'
+
+
+class Interval(collections.namedtuple('Interval', 'start end tags')):
+    '''An interval as in the data files, where `end` is OPEN_END if open'''
+
+    @classmethod
+    def parse(cls, line):
+        match = DATA_LINE_PATTERN.match(line)
+        if not match:
+            return None
+        start, end, tags = match.groups()
+        return cls(
+            start.decode('ascii'), end.decode('ascii') if end else OPEN_END,
+            tags.decode('utf-8') if tags else '')
+
+    @property
+    def opened(self):
+        return self.end == OPEN_END
+
+    def format(self):
+        line = 'inc ' + self.start
+        if not self.opened:
+            line += ' - ' + self.end
+        if self.tags:
+            line += ' # ' + self.tags
+        return line + '\n'
+
+
+def data_folder(path):
+    sub = os.path.join(path, 'data')
+    return sub if os.path.isdir(sub) else path
+
+
+def month_files(folder):
+    '''Map the months in `folder` to the paths of their files'''
+    months = collections.defaultdict(list)
+    for name in sorted(os.listdir(folder)):
+        match = MONTH_FILE_PATTERN.match(name)
+        if match:
+            months[match.group(1)].append(os.path.join(folder, name))
+    return months
+
+
+def iter_host(folder, stats, consumed):
+    '''
+    Yield the intervals of a host ordered, one month at a time, adding the
+    paths of the files read to `consumed`
+    '''
+    months = month_files(folder)
+    for month in sorted(months):
+        intervals = []
+        for path in months[month]:
+            consumed.add(path)
+            with open(path, 'rb') as f:
+                for line in f:
+                    line = line.rstrip(b'\n')
+                    interval = Interval.parse(line)
+                    if interval is not None:
+                        intervals.append(interval)
+                    elif line.strip():
+                        stats['unknown'] += 1
+        intervals.sort()
+        stats['read'] += len(intervals)
+        yield from intervals
+
+
+def resolve(intervals, stats):
+    '''Yield the ordered `intervals` without duplicates nor overlaps'''
+    last = None
+    for interval in intervals:
+        if last is None:
+            last = interval
+        elif interval == last:
+            stats['duplicate'] += 1
+        elif interval.start >= last.end:
+            yield last
+            last = interval
+        elif interval.tags == last.tags:
+            if last.opened or interval.opened:
+                end = min(last.end, interval.end)
+            else:
+                end = max(last.end, interval.end)
+            last = last._replace(end=end)
+            stats['joined'] += 1
+        elif last.opened:
+            # Starting another interval stops the open one.
+            if interval.start > last.start:
+                yield last._replace(end=interval.start)
+                stats['cut'] += 1
+            else:
+                stats['dropped'] += 1
+            last = interval
+        elif interval.end <= last.end:
+            stats['dropped'] += 1
+        else:
+            stats['cut'] += 1
+            yield last
+            last = interval._replace(start=last.end)
+    if last is not None:
+        yield last
+
+
+def merge(folders, output_folder):
+    stats, consumed = collections.Counter(), set()
+    hosts = [
+        iter_host(data_folder(folder), stats, consumed) for folder in folders]
+    os.makedirs(output_folder, exist_ok=True)
+    # Written aside first, as the output may be one of the inputs.
+    with tempfile.TemporaryDirectory(dir=output_folder) as tmpdir:
+        names, out = [], None
+        for interval in resolve(heapq.merge(*hosts), stats):
+            name = '%s-%s.data' % (interval.start[:4], interval.start[4:6])
+            if not names or names[-1] != name:
+                if out:
+                    out.close()
+                names.append(name)
+                out = open(os.path.join(tmpdir, name), 'w', encoding='utf-8')
+            out.write(interval.format())
+            stats['written'] += 1
+        if out:
+            out.close()
+        for name in names:
+            os.replace(
+                os.path.join(tmpdir, name), os.path.join(output_folder, name))
+    # The copies merged into the month files would be counted again.
+    for path in consumed:
+        name = os.path.basename(path)
+        if (not DATA_FILE_PATTERN.match(name) and
+                os.path.samefile(os.path.dirname(path), output_folder)):
+            os.remove(path)
+            stats['removed'] += 1
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('folders', nargs='+', metavar='DATA')
+    parser.add_argument(
+        '-o', '--output', required=True,
+        help='data folder to write the merged month files into')
+    args = parser.parse_args()
+    stats = merge(args.folders, data_folder(args.output))
+    print(
+        '%(read)d intervals read, %(written)d written: '
+        '%(duplicate)d duplicates, %(joined)d joined, %(cut)d cut, '
+        '%(dropped)d dropped' % stats, file=sys.stderr)
+    if stats['removed']:
+        print('%d conflicted copies merged were removed' % stats['removed'],
+              file=sys.stderr)
+    if stats['unknown']:
+        print('%d lines not understood were skipped' % stats['unknown'],
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
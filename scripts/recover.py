@@ -5,79 +5,295 @@ Maybe it is because of the use of cloud storage I don't know.
 Using taskserver or simply git to manage the data is recommended.
 And here comes a script to recovery completed.data and pending.data
 from backlog.data.
+
+The backlog is streamed and only the latest version of every task is kept.
+When they take more memory than allowed, the versions are sorted by uuid
+into runs on disk, which are merged to find the latest ones, and these are
+then sorted by `entry` the same way.
+
+    python3 recover.py [--memory MB] [--jobs N] [input [output]]
 '''
 
 import os
+import re
 import json
-import time
-import datetime
-from collections import OrderedDict
+import heapq
+import calendar
+import argparse
+import tempfile
+import collections
+
+
+DATE_PATTERN = re.compile(r'^\d{8}T\d{6}Z$')
+# Bytes a kept task takes besides its line, roughly.
+RECORD_OVERHEAD = 200
+# Bytes of backlog.data parsed at once by a process with --jobs.
+MIN_RANGE_SIZE = 1 << 20
+MAX_RANGE_SIZE = 16 << 20
+# Runs on disk merged at once, to keep the open files few.
+FAN_IN = 64
 
 
 def utc2time(date):
-    return int(
-        time.mktime(
-            datetime.datetime.strptime(date, '%Y%m%dT%H%M%SZ').timetuple()) -
-        time.timezone)
+    return calendar.timegm((
+        int(date[:4]), int(date[4:6]), int(date[6:8]),
+        int(date[9:11]), int(date[11:13]), int(date[13:15])))
+
+
+def format_task(task):
+    '''Convert a task of backlog.data into the attributes of pending.data'''
+    for k, v in task.items():
+        if isinstance(v, str) and DATE_PATTERN.match(v):
+            task[k] = utc2time(v)
+    if task.get('tracked') and task['tracked'][0] == 'P':
+        del task['tracked']
+    if task.get('tags'):
+        task['tags'] = ','.join(task['tags'])
+    if task.get('annotations'):
+        for anno in task.pop('annotations'):
+            task['annotation_%s' % utc2time(anno['entry'])] = anno[
+                'description']
+    return dict(
+        (k, json.dumps(v if isinstance(v, str) else str(v),
+                       ensure_ascii=False))
+        for k, v in task.items())
+
+
+def parse_data_line(line):
+    '''The attributes of a line of pending.data or completed.data'''
+    row = line.split('" ')
+    row[0] = row[0][1:]
+    row[-1] = row[-1][:-2]
+    return dict((col + '"').split(':', 1) for col in row)
+
+
+def to_record(task, seq):
+    '''
+    A task as (entry, uuid, seq, pending, line) where `seq` tells which of
+    the versions of a task is the latest
+    '''
+    line = '[%s]' % ' '.join(sorted('%s:%s' % kv for kv in task.items()))
+    pending = task['status'] in ('"pending"', '"waiting"')
+    return (task.get('entry', ''), task['uuid'], seq, pending, line)
+
+
+def byte_ranges(path, size):
+    '''Split the file at `path` into ranges of about `size` bytes of lines'''
+    total = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        start = 0
+        while start < total:
+            f.seek(min(start + size, total))
+            f.readline()
+            yield start, f.tell()
+            start = f.tell()
+
+
+def iter_backlog(path, start=0, end=None):
+    '''
+    Yield the records of the versions of tasks in the range of backlog.data,
+    with the offsets of their lines to tell the latest
+    '''
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        for line in f:
+            if end is not None and pos >= end:
+                break
+            seq, pos = pos, pos + len(line)
+            if line.strip():
+                yield to_record(format_task(json.loads(line)), seq)
+
+
+def parse_backlog_range(path, start, end):
+    '''The latest records by uuid in a range of backlog.data'''
+    records = {}
+    for record in iter_backlog(path, start, end):
+        records[record[1]] = record
+    return list(records.values())
+
+
+def read_tasks(input_folder, jobs=1):
+    '''
+    Yield the records of the versions of tasks, where the data files come
+    after the backlog. With `jobs` the backlog is parsed by a pool of
+    processes in ranges, yielding only the latest versions in every range.
+    At most 2 ranges a process are parsed ahead of the ones yielded, so
+    that the memory taken stays bounded.
+    '''
+    path = os.path.join(input_folder, 'backlog.data')
+    size = os.path.getsize(path)
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        ranges = byte_ranges(path, min(
+            MAX_RANGE_SIZE, max(MIN_RANGE_SIZE, size // (jobs * 4))))
+        with ProcessPoolExecutor(jobs) as executor:
+            window = collections.deque()
+            for start, end in ranges:
+                window.append(
+                    executor.submit(parse_backlog_range, path, start, end))
+                if len(window) >= jobs * 2:
+                    yield from window.popleft().result()
+            while window:
+                yield from window.popleft().result()
+    else:
+        yield from iter_backlog(path)
+
+    seq = size
+    for path in ('completed.data', 'pending.data'):
+        path = os.path.join(input_folder, path)
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line:
+                    seq += 1
+                    yield to_record(parse_data_line(line), seq)
+
 
+class Runs:
+    '''
+    Records sorted by `key`, spilled into sorted runs on disk when they take
+    more memory than allowed, and merged at most FAN_IN runs at a time
+    '''
 
-def recover(input_folder, output_folder=None):
+    def __init__(self, memory, tmpdir, name, key):
+        self.memory, self.tmpdir, self.name, self.key = (
+            memory, tmpdir, name, key)
+        self.count, self.paths = 0, []
+        self.clear()
+
+    def clear(self):
+        self.records, self.size = [], 0
+
+    def add(self, record):
+        self.records.append(record)
+        self.size += RECORD_OVERHEAD + len(record[4])
+        if self.size > self.memory:
+            self.spill()
+
+    def sorted_records(self):
+        return sorted(self.records, key=self.key)
+
+    def write_run(self, records):
+        path = os.path.join(self.tmpdir, '%s%d' % (self.name, self.count))
+        self.count += 1
+        with open(path, 'w', encoding='utf-8') as f:
+            for entry, uuid, seq, pending, line in records:
+                f.write('%s\t%s\t%d\t%d\t%s\n' % (
+                    entry, uuid, seq, pending, line))
+        return path
+
+    def spill(self):
+        self.paths.append(self.write_run(self.sorted_records()))
+        self.clear()
+
+    @staticmethod
+    def read_run(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                entry, uuid, seq, pending, line = line[:-1].split('\t', 4)
+                yield entry, uuid, int(seq), pending == '1', line
+        os.remove(path)
+
+    def merged(self):
+        '''All records sorted by `key`'''
+        if not self.paths:
+            return iter(self.sorted_records())
+        # The records left in memory make a run too, to free the memory.
+        self.spill()
+        paths = self.paths
+        while len(paths) > FAN_IN:
+            paths = [
+                self.write_run(heapq.merge(
+                    *map(self.read_run, paths[i:i + FAN_IN]), key=self.key))
+                for i in range(0, len(paths), FAN_IN)]
+        return heapq.merge(*map(self.read_run, paths), key=self.key)
+
+
+class LatestRuns(Runs):
+    '''Runs keeping only the latest version of every task in memory'''
+
+    def clear(self):
+        self.records, self.size = {}, 0
+
+    def add(self, record):
+        uuid = record[1]
+        old = self.records.get(uuid)
+        if old is not None and old[2] > record[2]:
+            return
+        if old is None:
+            self.size += RECORD_OVERHEAD
+        else:
+            self.size -= len(old[4])
+        self.records[uuid] = record
+        self.size += len(record[4])
+        if self.size > self.memory:
+            self.spill()
+
+    def sorted_records(self):
+        return sorted(self.records.values(), key=self.key)
+
+
+def latest_versions(versions):
+    '''The last of the versions of every task, given sorted by uuid, seq'''
+    last = None
+    for record in versions:
+        if last is not None and last[1] != record[1]:
+            yield last
+        last = record
+    if last is not None:
+        yield last
+
+
+def recover(input_folder, output_folder=None, memory=64 << 20, jobs=1):
     assert os.path.isdir(input_folder)
     if output_folder:
         assert os.path.isdir(output_folder)
     else:
         output_folder = input_folder
-    tasks = OrderedDict()
-    with open(os.path.join(input_folder, 'backlog.data')) as f:
-        for line in f.readlines():
-            task = json.loads(line)
-            for k in task:
-                try:
-                    task[k] = utc2time(task[k])
-                except:
-                    pass
-            if task.get('tracked') and task['tracked'][0] == 'P':
-                del task['tracked']
-            if task.get('tags'):
-                task['tags'] = ','.join(task['tags'])
-            if task.get('annotations'):
-                for anno in task.pop('annotations'):
-                    task['annotation_%s' % utc2time(anno['entry'])] = anno[
-                        'description']
-            for k in task:
-                task[k] = json.dumps(
-                    task[k] if isinstance(task[k], basestring)
-                    else str(task[k]),
-                    ensure_ascii=False)
-            tasks[task['uuid']] = task
 
-    for path in ('completed.data', 'pending.data'):
-        with open(os.path.join(input_folder, path)) as f:
-            for line in f.read().decode('utf8').splitlines():
-                row = line.split('" ')
-                row[0] = row[0][1:]
-                row[-1] = row[-1][:-2]
-                task = dict((col + '"').split(':', 1) for col in row)
-                tasks[task['uuid']] = task
-
-    pending, completed = [], []
-    for task in tasks.values():
-        _task = '[%s]' % ' '.join(
-            sorted(['%s:%s' % kv for kv in task.items()])).encode('utf8')
-        if task['status'] in ('"pending"', '"waiting"'):
-            pending.append((task['entry'], _task))
-        else:
-            completed.append((task['entry'], _task))
-    pending = [x[1] for x in sorted(pending, key=lambda x: x[0])]
-    completed = [x[1] for x in sorted(completed, key=lambda x: x[0])]
+    with tempfile.TemporaryDirectory(dir=output_folder) as tmpdir:
+        # The latest version of every task is found by uuid first, as the
+        # entry of a task may differ between its versions.
+        versions = LatestRuns(
+            memory, tmpdir, 'versions', key=lambda r: (r[1], r[2]))
+        for record in read_tasks(input_folder, jobs):
+            versions.add(record)
+        tasks = Runs(memory, tmpdir, 'tasks', key=lambda r: (r[0], r[1]))
+        for record in latest_versions(versions.merged()):
+            tasks.add(record)
+        # Written aside first, as the input may be the same folder.
+        paths = [os.path.join(tmpdir, p) for p in ('completed', 'pending')]
+        with open(paths[0], 'w', encoding='utf-8') as completed, \
+                open(paths[1], 'w', encoding='utf-8') as pending:
+            for record in tasks.merged():
+                (pending if record[3] else completed).write(record[4] + '\n')
+        for path, name in zip(paths, ('completed.data', 'pending.data')):
+            os.replace(path, os.path.join(output_folder, name))
 
-    with open(os.path.join(output_folder, 'completed.data'), 'w') as f:
-        f.write('\n'.join(completed))
-    with open(os.path.join(output_folder, 'pending.data'), 'w') as f:
-        f.write('\n'.join(pending))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        'input_folder', nargs='?',
+        default=os.path.join(os.path.expanduser('~'), '.task'))
+    parser.add_argument(
+        'output_folder', nargs='?',
+        default=os.path.dirname(os.path.realpath(__file__)))
+    parser.add_argument(
+        '--memory', type=int, default=64,
+        help='MB of tasks kept in memory before sorting them on disk')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='processes parsing backlog.data, 0 for one per core')
+    args = parser.parse_args()
+    recover(
+        args.input_folder, args.output_folder, args.memory << 20,
+        args.jobs or os.cpu_count())
 
 
 if __name__ == '__main__':
-    recover(
-        os.path.join(os.getenv('HOME'), '.task'),
-        os.path.dirname(os.path.realpath(__file__)))
+    main()
@@ -1,7 +1,5 @@
 import os
 
-import yaml
-
 
 # With configured tag `pomodoro` timewarrior tracks time in Pomodoro Mode.
 # Concentrating for 25 minutes achieves a pomodoro.
@@ -16,9 +14,77 @@ POMODORO_SET_COUNT = 4
 POMODORO_ABORT_GAP = 120
 POMODORO_COMBO_GAP = 300
 
+# Where timewarrior keeps its data.
+TIMEWARRIOR_DB = os.getenv('TIMEWARRIORDB') or os.path.join(
+    os.path.expanduser('~'), '.timewarrior')
+
+# Task metadata and other derived data shared by the hooks and extensions
+# are cached in a SQLite database under this folder.
+CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'pomodoro-warriors')
+
+# Events for ActivityWatch are spooled under CACHE_DIR and sent to aw-server
+# in background, retried up to AW_RETRIES times with exponential backoff.
+# Events aw-server rejects are set aside in aw-spool.jsonl.rejected.
+AW_SERVER = 'localhost:5600'
+AW_TIMEOUT = 5
+AW_RETRIES = 5
+
+# Tasks missing in the cache are exported by chunks of UUIDs in parallel.
+EXPORT_CHUNK_SIZE = 200
+EXPORT_WORKERS = 4
+
+# Logs of jrnl are asked from taskopen by this many threads at once,
+# unless the path to the journal file of jrnl is given to read it directly.
+JRNL_WORKERS = 4
+JRNL_JOURNAL = None
+
+# With BULK_COMPLETIONS the hook on-modify only notes the tasks completed by
+# a command like `task 1-500 done`, and on-exit reports the time tracked for
+# all of them at once, calling timewarrior once or twice in total.
+BULK_COMPLETIONS = False
+
+# Trace the hooks and extensions into this file, see tracing.py.
+TRACE_PATH = os.getenv('POMODORO_TRACE')
+
+
+def load_yaml(ypath):
+    '''
+    The settings in `ypath`, kept compiled under CACHE_DIR until the file
+    changes, so that PyYAML is imported only then
+    '''
+    import marshal
+
+    ystat = os.stat(ypath)
+    stamp = (ypath, ystat.st_mtime_ns, ystat.st_size)
+    cpath = os.path.join(CACHE_DIR, 'settings.marshal')
+    try:
+        with open(cpath, 'rb') as cfile:
+            cstamp, values = marshal.load(cfile)
+        if cstamp == stamp:
+            return values
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    import yaml
+
+    with open(ypath) as yfile:
+        values = yaml.load(yfile)
+    tmp = '%s.%s' % (cpath, os.getpid())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp, 'wb') as cfile:
+            marshal.dump((stamp, values), cfile)
+        os.replace(tmp, cpath)
+    except (OSError, ValueError):
+        # Values like dates can't be compiled, they are parsed every time.
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return values
+
+
 # load settings from settings.yaml, which is ignoed in git
 ypath = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), 'settings.yaml')
 if os.path.isfile(ypath):
-    with open(ypath) as yfile:
-        globals().update(yaml.load(yfile))
+    globals().update(load_yaml(ypath))
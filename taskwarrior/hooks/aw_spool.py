@@ -0,0 +1,173 @@
+#!/usr/bin/env python3.10
+# Spool of events for ActivityWatch
+#
+# The hook appends events to a spool file and returns at once. This script,
+# started in background, sends them in batches to aw-server over a single
+# connection, and keeps them for the next time if aw-server is unreachable.
+# Events aw-server rejects are set aside in another file instead of being
+# retried forever.
+
+import os
+import sys
+import json
+import time
+import fcntl
+import subprocess
+
+from utils import settings
+
+
+SPOOL_PATH = os.path.join(settings.CACHE_DIR, "aw-spool.jsonl")
+# Events being sent, kept until aw-server has accepted them.
+BATCH_PATH = SPOOL_PATH + ".sending"
+LOCK_PATH = SPOOL_PATH + ".lock"
+# Events aw-server rejected, kept to be looked at.
+REJECTED_PATH = SPOOL_PATH + ".rejected"
+
+
+def open_locked(path, mode):
+    """Open `path` locked, even if it was renamed while waiting for the lock"""
+    while 1:
+        f = open(path, mode)
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
+
+
+def spool(bucket, bucket_data, event):
+    os.makedirs(settings.CACHE_DIR, exist_ok=True)
+    line = json.dumps({"bucket": bucket, "bucket_data": bucket_data, "event": event})
+    with open_locked(SPOOL_PATH, "a") as f:
+        f.write(line + "\n")
+
+
+def start_flusher():
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def take_batch():
+    """Move the spooled events into the batch and return all events in it"""
+    if os.path.exists(SPOOL_PATH):
+        with open_locked(SPOOL_PATH, "r") as spooled, open(BATCH_PATH, "a") as batch:
+            batch.write(spooled.read())
+            batch.flush()
+            os.fsync(batch.fileno())
+            os.remove(SPOOL_PATH)
+    if not os.path.exists(BATCH_PATH):
+        return []
+    with open(BATCH_PATH) as batch:
+        return [json.loads(line) for line in batch if line.strip()]
+
+
+def set_aside(records):
+    with open(REJECTED_PATH, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+class Rejected(IOError):
+    """aw-server refused a request, which would be refused again as it is"""
+
+    def __init__(self, status, reason):
+        super().__init__("aw-server: %s %s" % (status, reason))
+        self.status = status
+
+
+class Client:
+    def __init__(self):
+        import http.client
+
+        self.conn = http.client.HTTPConnection(
+            settings.AW_SERVER, timeout=settings.AW_TIMEOUT
+        )
+
+    def post(self, path, data):
+        self.conn.request(
+            "POST",
+            "/api/0/buckets/%s" % path,
+            body=json.dumps(data),
+            headers={"Content-Type": "application/json"},
+        )
+        res = self.conn.getresponse()
+        res.read()
+        # aw-server answers 304 when the bucket already exists.
+        if 400 <= res.status < 500:
+            raise Rejected(res.status, res.reason)
+        if res.status >= 500:
+            raise IOError("aw-server: %s %s" % (res.status, res.reason))
+
+    def post_events(self, bucket, records):
+        """Send the events of `bucket`, creating it if it is not there"""
+        marker = os.path.join(settings.CACHE_DIR, "aw-bucket.%s" % bucket)
+        events = [record["event"] for record in records]
+        created = not os.path.exists(marker)
+        if created:
+            self.post(bucket, records[0]["bucket_data"])
+            open(marker, "w").close()
+        try:
+            self.post(bucket + "/events", events)
+        except Rejected as e:
+            if e.status != 404 or created:
+                raise
+            # The bucket is gone, as when aw-server was reset.
+            os.remove(marker)
+            self.post(bucket, records[0]["bucket_data"])
+            open(marker, "w").close()
+            self.post(bucket + "/events", events)
+
+    def send(self, records):
+        """
+        Send the events by bucket, returning the records aw-server rejected.
+        When it rejects the events of a bucket, they are sent one by one to
+        find the ones it rejects.
+        """
+        buckets, rejected = {}, []
+        for record in records:
+            buckets.setdefault(record["bucket"], []).append(record)
+        for bucket, records in buckets.items():
+            try:
+                self.post_events(bucket, records)
+            except Rejected:
+                for record in records:
+                    try:
+                        self.post_events(bucket, [record])
+                    except Rejected:
+                        rejected.append(record)
+        return rejected
+
+
+def flush():
+    os.makedirs(settings.CACHE_DIR, exist_ok=True)
+    with open(LOCK_PATH, "a") as lock:
+        # Wait for any other flusher, which may have missed our events.
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        client, attempt = Client(), 0
+        while attempt < settings.AW_RETRIES:
+            records = take_batch()
+            if not records:
+                return
+            try:
+                rejected = client.send(records)
+            except (OSError, ValueError):
+                client.conn.close()
+                time.sleep(2**attempt)
+                attempt += 1
+                continue
+            if rejected:
+                set_aside(rejected)
+            os.remove(BATCH_PATH)
+            attempt = 0
+
+
+if __name__ == "__main__":
+    flush()
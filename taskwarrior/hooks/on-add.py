@@ -0,0 +1,15 @@
+#!/usr/bin/env python3.10
+
+import json
+
+import utils
+
+
+def main():
+    inputs = utils.format_inputs()
+    task = inputs["task"]
+    utils.cache_task(task, inputs["data"])
+    print(json.dumps(task))
+
+
+main()
@@ -1,55 +1,229 @@
 #!/usr/bin/env python3.10
 
-import os
-import subprocess
+import json
 
 import utils
+import tracking
+from utils import settings
 
 
 RESERVED_TAGS = set("nocolor nonag nocal next".split())
+# Separates the mods of subtasks in `task <id> split <mods> , <mods> ...`
+SPLIT_SEPARATOR = ","
+# Attributes imported as they are. The others, like `due:tomorrow` and UDAs,
+# need taskwarrior to interpret them and are applied with `task modify`.
+IMPORTED_ATTRIBUTES = {"project", "priority", "estimate"}
+# Known even if `task _columns` can't tell.
+DEFERRED_ATTRIBUTES = {
+    "due", "scheduled", "wait", "until", "recur", "depends", "start", "end"
+}
+
+
+def export(_id):
+    """Read the task of `_id` with a single call of `task`"""
+    import subprocess
+
+    output = subprocess.run(
+        ["task", "rc.hooks=off", str(_id), "export"],
+        encoding="utf-8",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    tasks = json.loads(output.stdout or "[]")
+    return tasks[0] if tasks else None
+
+
+def task_import(tasks):
+    """Add or update all `tasks` with a single call of `task import`"""
+    import subprocess
+
+    output = subprocess.run(
+        ["task", "rc.verbose=nothing", "import", "-"],
+        input="\n".join(json.dumps(task) for task in tasks),
+        encoding="utf-8",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if output.returncode:
+        print(output.stdout + output.stderr)
+    return not output.returncode
+
+
+def now():
+    import datetime
+
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def attributes():
+    """The attributes of tasks, UDAs included, as `task _columns` lists"""
+    import subprocess
+
+    output = subprocess.run(
+        ["task", "rc.hooks=off", "_columns"],
+        encoding="utf-8",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    return set(output.stdout.split()) | IMPORTED_ATTRIBUTES | DEFERRED_ATTRIBUTES
+
+
+def attribute(name, known):
+    """The one of `known` which `name` is, or abbreviates to 3 letters or more"""
+    if name in known:
+        return name
+    if len(name) < 3:
+        return None
+    names = [attr for attr in known if attr.startswith(name)]
+    return names[0] if len(names) == 1 else None
+
+
+def parse_mods(mods, known):
+    """
+    Parse `+tag project:sub description` into the attributes which can be
+    imported and the mods left to `task modify`. Words like `Re:` which
+    are not `known` attributes stay in the description.
+    """
+    attrs, tags, words, deferred = {}, [], [], []
+    for word in mods.split():
+        name, sep, value = word.partition(":")
+        attr = attribute(name, known) if sep else None
+        if word.startswith("+") and len(word) > 1:
+            tags.append(word[1:])
+        elif attr in IMPORTED_ATTRIBUTES:
+            if attr == "estimate" and not utils.DURATION_PATTERN.match(value):
+                deferred.append(word)
+            else:
+                attrs[attr] = value
+        elif attr:
+            deferred.append(word)
+        else:
+            words.append(word)
+    if tags:
+        attrs["tags"] = tags
+    attrs["description"] = " ".join(words)
+    return attrs, " ".join(deferred)
+
+
+def split(_id, mods):
+    """task <id> split <mods> [, <mods> ...]"""
+    import uuid
+    import subprocess
+
+    parent = export(_id)
+    if not parent or not parent.get("project"):
+        print("You can only split a task when it is a project.")
+        return
+    subtasks, deferred = [], {}
+    known = attributes() if ":" in mods else set()
+    for submods in mods.split(" %s " % SPLIT_SEPARATOR):
+        attrs, rest = parse_mods(submods, known)
+        # A subproject is put under the project of the parent task.
+        if attrs.get("project"):
+            attrs["project"] = "%s.%s" % (parent["project"], attrs["project"])
+        else:
+            attrs["project"] = parent["project"]
+        subtask = dict(attrs, uuid=str(uuid.uuid4()), status="pending", entry=now())
+        subtasks.append(subtask)
+        if rest:
+            deferred.setdefault(rest, []).append(subtask["uuid"])
+
+    # Exported as a list since taskwarrior 2.6 and as a string before.
+    depends = parent.get("depends") or []
+    uuids = [subtask["uuid"] for subtask in subtasks]
+    if isinstance(depends, str):
+        parent["depends"] = ",".join(depends.split(",") + uuids)
+    else:
+        parent["depends"] = depends + uuids
+    parent["modified"] = now()
+
+    if not task_import(subtasks + [parent]):
+        return
+    for rest, uuids in deferred.items():
+        subprocess.run(
+            ["task", "rc.confirmation=off", "rc.bulk=0"]
+            + uuids
+            + ["modify"]
+            + rest.split()
+        )
+    # Told by their IDs as `task add` does.
+    output = subprocess.run(
+        ["task", "rc.hooks=off", "_get"]
+        + ["%s.id" % subtask["uuid"] for subtask in subtasks],
+        encoding="utf-8",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    ids = output.stdout.split()
+    if len(ids) != len(subtasks):
+        ids = ["0"] * len(subtasks)
+    for _id, subtask in zip(ids, subtasks):
+        print("Created task %s." % (_id if _id != "0" else subtask["uuid"][:8]))
+
+
+def timew(_id, args):
+    """task <id> timew ..."""
+    import subprocess
+
+    task = export(_id)
+    if not task:
+        return
+    tags = [t for t in task.get("tags", []) if t not in RESERVED_TAGS]
+    proj = task.get("project")
+    while proj:
+        tags.append(proj)
+        proj = proj.rpartition(".")[0]
+    tags.append(task["uuid"])
+    tags = " ".join('"%s"' % t for t in tags)
+    if subprocess.run("timew %s %s" % (args, tags), shell=True).returncode:
+        tracking.invalidate()
+        return
+    # Whatever `args` did, the interval tracked last is what timew tells.
+    tracking.refresh()
+    if "start" not in task:
+        task["start"] = task["modified"] = now()
+        task_import([task])
+
+
+def report_completed():
+    """Time tracked for the tasks completed by this command, all at once"""
+    import datetime
+    import subprocess
+
+    tasks = utils.take_completed()
+    if not tasks:
+        return
+    index, opened = utils.scan_tracked()
+    uuid = opened and next((t for t in opened["tags"] if utils.is_uuid(t)), None)
+    if uuid in {task["uuid"] for task in tasks}:
+        subprocess.run(["timew", "stop", ":quiet"], stdout=subprocess.DEVNULL)
+        # Folds the interval just closed as timew ended it.
+        index, _ = utils.scan_tracked()
+    for task in tasks:
+        print('Task %s "%s"' % (task["uuid"][:8], task["description"]))
+        if "estimate" in task:
+            print("  Estimate Duration: %s" % utils.parse_duration(task["estimate"]))
+        seconds = index.seconds(task["uuid"])
+        print("  Total Duration: %s" % datetime.timedelta(seconds=seconds))
 
 
 def main():
+    # This runs after every command of taskwarrior, so modules which only
+    # `split` and `timew` need are imported by them.
     inputs = utils.format_inputs()
     args, cmd = inputs["args"], inputs["command"]
+    # Before any command below changes the data files again.
+    utils.carry_cached_tasks(inputs["data"])
+    if settings.BULK_COMPLETIONS:
+        report_completed()
     if cmd == "split":
         # task <id> split <mods>
         pre, mods = args.split(cmd, 1)
-        print(pre, mods, sep="\n")
-        _id = int(pre.split()[1])
-        mods = (
-            (mods + " ")
-            .replace(" project: ", "")
-            .replace(" project:", " project:{}.")
-            .strip()
-        )
-        if " project:" not in mods:
-            mods += " project:{}"
-        subid = subprocess.getoutput(
-            "task _get %s.project | "
-            "xargs -I{} task add %s | "
-            'grep -o "[0-9]\\+"' % (_id, mods)
-        )
-        if subid:
-            print("Created task %s." % (subid))
-            os.system("task %s modify depends:%s" % (_id, subid))
-        else:
-            print("You can only split a task when it is a project.")
+        split(int(pre.split()[1]), mods)
     elif cmd == "timew":
         # task <id> timew ...
-        pre, timew = args.split(cmd, 1)
-        _id = int(pre.split()[1])
-        proj = subprocess.getoutput("task _get %s.project" % (_id))
-        tags, uuid = subprocess.getoutput(
-            "task _get %s.tags %s.uuid" % (_id, _id)
-        ).split(" ", 2)
-        tags = [t for t in tags.split(",") if t and t not in RESERVED_TAGS]
-        while proj:
-            tags.append(proj)
-            proj = proj.rpartition(".")[0]
-        tags.append(uuid)
-        tags = " ".join('"%s"' % t for t in tags)
-        subprocess.run("timew %s %s && task %s start" % (timew, tags, _id), shell=True)
+        pre, timew_args = args.split(cmd, 1)
+        timew(int(pre.split()[1]), timew_args)
 
 
 main()
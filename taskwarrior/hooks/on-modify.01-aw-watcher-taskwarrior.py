@@ -5,35 +5,28 @@
 
 # License: GNU GPLv3
 
-from datetime import datetime, timezone
-from requests import post
-from socket import gethostname
-# from time import sleep
-
-
 import json
 import sys
 
-# from aw_core.models import Event
-# from aw_client import ActivityWatchClient
-
 old = json.loads(sys.stdin.readline())
 new = json.loads(sys.stdin.readline())
 
 if "start" in old and ("start" not in new or "stop" in new):
+    # Imported only when a task is stopped, as this runs on every modification.
+    from datetime import datetime, timezone
+    from socket import gethostname
+
+    import aw_spool
+
     start = datetime.strptime(old["start"], "%Y%m%dT%H%M%S%z")
-    # We'll run with testing=True so we don't mess up any production instance.
-    # Make sure you've started aw-server with the `--testing` flag as well.
 
     bucket_id = "{}_{}".format("aw-watcher-warrior", gethostname())
-    url = f"http://localhost:5600/api/0/buckets/{bucket_id}"
-    res = post(url, json={
+    bucket_data = {
         'type': 'tw.task.active',
         'hostname': gethostname(),
         'client': "taskwarrior hook",
         "name": "TaskWarrior",
-    })
-    # print(f"{bucket_id}", res.text)
+    }
 
     if "project" not in new:
         active_task_data = {
@@ -47,22 +40,15 @@ if "start" in old and ("start" not in new or "stop" in new):
     now = datetime.now(timezone.utc)
 
     duration = now - start
-    # print ("Duration: ", duration)
-    # active_task_event = Event(timestamp=start, data=active_task_data, duration=int(duration.seconds))
-    # inserted_event = client.insert_event(bucket_id, active_task_event)
 
-    url = f"http://localhost:5600/api/0/buckets/{bucket_id}/events"
-
-    res = post(
-        url=url,
-        json={
-            "timestamp": str(start),
-            "data": active_task_data,
-            "duration": int(duration.seconds),
-        },
-        timeout=2000,
-    )
-    # print(res.text)
+    # Sent to aw-server in background so that aw-server being down or slow
+    # never holds taskwarrior up.
+    aw_spool.spool(bucket_id, bucket_data, {
+        "timestamp": str(start),
+        "data": active_task_data,
+        "duration": int(duration.seconds),
+    })
+    aw_spool.start_flusher()
 
 
 if new:
@@ -1,23 +1,33 @@
 #!/usr/bin/env python3.10
 
 import json
-import subprocess
 
 import utils
+import tracking
+from utils import settings
 
 
 def main():
     inputs = utils.format_inputs()
     task = inputs["task"]
     ret = [json.dumps(task)]
-    if "end" in task and "end" not in inputs["prior"]:
-        timew = json.loads(subprocess.getoutput("timew get dom.tracked.1.json"))
-        cmd = 'timew duration "%(uuid)s" from %(entry)s - %(end)s' % task
-        if "end" not in timew and task["uuid"] in timew["tags"]:
-            cmd = "timew stop :quiet && " + cmd
+    utils.cache_task(task, inputs["data"])
+    completed = "end" in task and "end" not in inputs["prior"]
+    if completed and settings.BULK_COMPLETIONS:
+        # Reported by on-exit.py together with the others of the command.
+        utils.journal_completed(task)
+    elif completed:
+        import datetime
+        import subprocess
+
+        tracked = tracking.current()
+        if "end" not in tracked and task["uuid"] in tracked.get("tags", []):
+            subprocess.run(["timew", "stop", ":quiet"], stdout=subprocess.DEVNULL)
+            tracking.stopped(tracked)
         if "estimate" in task:
             ret.append("Estimate Duration: %s" % utils.parse_duration(task["estimate"]))
-        ret.append("Total Duration: %s" % subprocess.getoutput(cmd))
+        seconds = utils.update_tracked().seconds(task["uuid"])
+        ret.append("Total Duration: %s" % datetime.timedelta(seconds=seconds))
     if len(ret) == 1:
         ret.append("")
     print("\n".join(ret))
@@ -4,13 +4,26 @@ import re
 import os
 import sys
 import json
-import datetime
+import time
+
+
+basedir = os.path.realpath(__file__)
+for i in range(3):
+    basedir = os.path.dirname(basedir)
+if basedir not in sys.path:
+    sys.path.append(basedir)
+import settings
+import tracing
+import tracking
+from cache import TaskCache, TrackedIndex, task_data_signature
 
 
 DURATION_PATTERN = re.compile(r"^P(\d+Y)?(\d+M)?(\d+D)?(?:T(\d+H)?(\d+M)?(\d+S)?)?$")
 
 
 def parse_duration(duration):
+    import datetime
+
     ds = DURATION_PATTERN.findall(duration)[0]
     assert ds, "not a duration compliant with ISO-8601: %s" % duration
     y, m, d, H, M, S = [int(d[:-1]) if d else 0 for d in ds]
@@ -18,6 +31,7 @@ def parse_duration(duration):
     return datetime.timedelta(seconds=s)
 
 
+@tracing.traced("format_inputs")
 def format_inputs():
     """
     // returned inputs example
@@ -47,3 +61,182 @@ def format_inputs():
         inputs["task"] = json.loads(sys.stdin.readline())
 
     return inputs
+
+
+def is_uuid(s):
+    "269795eb-57a4-46d0-b636-4d2ff5ad5c49"
+    return len(s) == 36 and s.count("-") == 4
+
+
+@tracing.traced("parse_epoch", aggregate=True)
+def parse_epoch(utcdate):
+    import calendar
+
+    return calendar.timegm(time.strptime(utcdate, "%Y%m%dT%H%M%SZ"))
+
+
+DATA_FILE_PATTERN = re.compile(r"^\d{4}-\d\d\.data$")
+
+
+def data_file_states():
+    """Map the months of the data files of timewarrior to their mtime and size"""
+    try:
+        entries = list(os.scandir(os.path.join(settings.TIMEWARRIOR_DB, "data")))
+    except FileNotFoundError:
+        return {}
+    states = {}
+    for entry in entries:
+        if DATA_FILE_PATTERN.match(entry.name):
+            st = entry.stat()
+            states[entry.name[:7]] = "%d:%d" % (st.st_mtime_ns, st.st_size)
+    return states
+
+
+def data_file_digest(month, until):
+    """
+    Digest of the intervals in the data file of `month` which started by
+    `until`, as in the data files, or None if there is no such file
+    """
+    import hashlib
+
+    path = os.path.join(settings.TIMEWARRIOR_DB, "data", month + ".data")
+    until, digest = until.encode("ascii"), hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                if line.startswith(b"inc ") and line[4:20] <= until:
+                    digest.update(line.rstrip(b"\n") + b"\n")
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def format_epoch(seconds):
+    return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(seconds))
+
+
+@tracing.traced("scan_tracked")
+def scan_tracked():
+    """
+    Fold the intervals closed since the last time into the TrackedIndex,
+    and return it with the open interval if any.
+
+    Only intervals starting after the last one folded in are expected in
+    the data files. A month whose file changed otherwise, as intervals were
+    added, modified or deleted there, is folded in again whole.
+    """
+    import subprocess
+
+    index = TrackedIndex()
+    watermark, folded, files = index.watermark(), index.months(), data_file_states()
+    if watermark is None:
+        reset = set(files).union(folded)
+    else:
+        until = format_epoch(watermark)
+
+        def changed(month):
+            signature, digest = folded.get(month, (None, None))
+            return (
+                files.get(month) != signature
+                and data_file_digest(month, until) != digest
+            )
+
+        reset = {
+            month
+            for month in set(files).union(folded)
+            if month <= "%s-%s" % (until[:4], until[4:6]) and changed(month)
+        }
+    args = ["timew", "export"]
+    if reset and watermark is not None:
+        args += ["from", min(reset).replace("-", "") + "01T000000Z"]
+    elif watermark is not None:
+        args += ["from", format_epoch(watermark)]
+    output = subprocess.run(
+        args, encoding="utf-8", stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    entries = json.loads(output.stdout or "[]")
+    intervals = (
+        (
+            parse_epoch(entry["start"]),
+            parse_epoch(entry["end"]),
+            next((tag for tag in entry["tags"] if is_uuid(tag)), None),
+        )
+        for entry in entries
+        if "end" in entry
+    )
+    months = index.fold(intervals, reset)
+    watermark = index.watermark()
+    if months:
+        until, states = format_epoch(watermark) if watermark else "", {}
+        for month in months:
+            digest = data_file_digest(month, until)
+            states[month] = None if digest is None else (files.get(month), digest)
+        index.keep(states)
+    if not entries:
+        return index, None
+    # The last interval exported is the one tracked last.
+    tracking.write(entries[-1])
+    return index, entries[-1] if "end" not in entries[-1] else None
+
+
+def update_tracked():
+    """Fold the intervals closed since the last time into the TrackedIndex"""
+    return scan_tracked()[0]
+
+
+def task_data_note():
+    """Where the data files of taskwarrior before the running command are noted"""
+    return os.path.join(settings.CACHE_DIR, "task-data.%d" % os.getppid())
+
+
+def cache_task(task, location):
+    """
+    Cache `task` as the running command changes it, noting the data files
+    of taskwarrior in `location` before the command for on-exit
+    """
+    signature = task_data_signature(location)
+    cache = TaskCache()
+    cache.put([task], cache.generation(signature))
+    note = task_data_note()
+    if not os.path.exists(note):
+        with open(note, "w") as f:
+            f.write(signature)
+
+
+def carry_cached_tasks(location):
+    """
+    Keep the tasks cached as of the data files in `location` the running
+    command wrote, as the tasks it changed were cached by the hooks
+    """
+    note = task_data_note()
+    try:
+        with open(note) as f:
+            signature = f.read()
+    except FileNotFoundError:
+        return
+    os.remove(note)
+    TaskCache().carry(signature, task_data_signature(location))
+
+
+def completed_journal():
+    """Where the tasks completed by the running command of taskwarrior go"""
+    # Hooks are all run by the process of the command.
+    return os.path.join(settings.CACHE_DIR, "completed.%d.jsonl" % os.getppid())
+
+
+def journal_completed(task):
+    os.makedirs(settings.CACHE_DIR, exist_ok=True)
+    with open(completed_journal(), "a") as f:
+        f.write(json.dumps(task) + "\n")
+
+
+def take_completed():
+    """The tasks completed by the running command, emptying the journal"""
+    path = completed_journal()
+    try:
+        with open(path) as f:
+            tasks = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+    os.remove(path)
+    return tasks
@@ -1,19 +1,18 @@
 #!/usr/bin/env python3.10
 
+import time
 import datetime
 
 import utils
 
 
 def main():
-    _, entries = utils.format_inputs()
-    now = datetime.datetime.now()
-    duration = datetime.timedelta()
+    _, entries = utils.format_inputs(stream=True)
+    now, seconds = int(time.time()), 0
     for entry in entries:
-        start = utils.parse_utc(entry["start"])
-        end = utils.parse_utc(entry["end"]) if "end" in entry else now
-        duration += end - start
-    print(duration)
+        end = utils.parse_epoch(entry["end"]) if "end" in entry else now
+        seconds += end - utils.parse_epoch(entry["start"])
+    print(datetime.timedelta(seconds=seconds))
 
 
 main()
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+'''
+Statistics of Pomodoro Mode over long ranges, by day and by hour of day.
+
+    timew pomo_analytics.py :quarter
+    timew pomo_analytics.py rc.reports.pomo_analytics.format=csv :month
+
+The rules of pomo_stat.Pomodoro are applied to arrays of all the intervals
+at once with NumPy, so the totals are the same as pomo_stat.py gives.
+Achieved, aborted and interrupted pomodoroes count at the end of the
+interval before them, and focus time at the start of every interval.
+'''
+
+import os
+import sys
+import json
+import time
+
+import utils
+from utils import settings, tracing
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+COUNTERS = ('achieved', 'aborted', 'interrupt', 'seconds', 'max_combo')
+
+
+def parse_epochs(dates):
+    '''Seconds since the epoch of dates like 20180101T000000Z, at once'''
+    digits = np.array(dates, dtype='S16').view(np.uint8).reshape(-1, 16)
+    digits = digits.astype(np.int64) - ord('0')
+
+    def number(start, stop):
+        n = 0
+        for i in range(start, stop):
+            n = n * 10 + digits[:, i]
+        return n
+
+    days = (
+        (number(0, 4) - 1970).astype('M8[Y]').astype('M8[M]') +
+        (number(4, 6) - 1)).astype('M8[D]') + (number(6, 8) - 1)
+    return (
+        days.astype(np.int64) * 86400 + number(9, 11) * 3600 +
+        number(11, 13) * 60 + number(13, 15))
+
+
+def first_in_groups(idx, groups):
+    '''The ones of the indices `idx` which come first in their groups'''
+    _, first = np.unique(groups[idx], return_index=True)
+    return idx[first]
+
+
+def group_starts(flags):
+    '''Index of the last set flag up to every position, or -1'''
+    return np.maximum.accumulate(
+        np.where(flags, np.arange(len(flags)), -1))
+
+
+class Analytics:
+    '''
+    Step k of Pomodoro comes before interval k, with step n finishing at
+    `now`. Arrays indexed by i hold step i + 1, which follows interval i.
+    '''
+
+    def __init__(self, starts, ends, now):
+        s, e = starts, ends
+        self.starts, self.ends, self.now = s, e, now
+        self.durations = e - s
+        self.gaps = np.append(s[1:], now)[:len(s)] - e
+        self.contiguous = self.gaps == 0
+        self.seconds_before = self.pomodoro_seconds()
+        self.achieved = self.seconds_before >= settings.POMODORO_DURATION
+        self.interrupt = ~self.contiguous & ~self.achieved
+        self.aborted = self.interrupt & (
+            self.gaps >= settings.POMODORO_ABORT_GAP)
+        self.combos, self.combo_resets = self.combo()
+
+    def pomodoro_seconds(self):
+        '''Seconds of the pomodoro going on before every step'''
+        n, total = len(self.durations), np.cumsum(self.durations)
+        # Steps after which the seconds start from 0 again for sure.
+        # Others do only when a pomodoro has been achieved before them,
+        # which is found for one pomodoro per group at a time.
+        reset = np.zeros(n, dtype=bool)
+        if n:
+            reset[0] = True
+            reset[1:] = self.contiguous[:-1] | (
+                self.gaps[:-1] >= settings.POMODORO_ABORT_GAP)
+        while 1:
+            starts = group_starts(reset)
+            seconds = total - np.where(starts > 0, total[starts - 1], 0)
+            more = seconds[:-1] >= settings.POMODORO_DURATION
+            idx = np.flatnonzero(more & ~reset[1:])
+            if not len(idx):
+                return seconds
+            reset[first_in_groups(idx, starts) + 1] = True
+
+    def combo(self):
+        '''The combo after every step, and the steps resetting it after'''
+        gaps = self.gaps - settings.POMODORO_COMBO_GAP
+        short, long = (
+            settings.POMODORO_SHORT_BREAK, settings.POMODORO_LONG_BREAK)
+        achieved = self.achieved & ~self.contiguous
+        resets = self.aborted | (achieved & (gaps >= max(short, long)))
+        # After a break between the short and the long one the combo is
+        # reset only if the set isn't complete, which depends on the combo.
+        undecided = achieved & ~resets & (gaps >= min(short, long))
+        total = np.cumsum(self.achieved)
+        if not len(total):
+            return total, resets
+        while 1:
+            last = np.append(-1, group_starts(resets)[:-1])
+            combos = total - np.where(last >= 0, total[last], 0)
+            idx = np.flatnonzero(undecided)
+            if not len(idx):
+                return combos, resets
+            idx = first_in_groups(idx, last)
+            breaks = np.where(
+                combos[idx] % settings.POMODORO_SET_COUNT, short, long)
+            resets[idx] = gaps[idx] >= breaks
+            undecided[idx] = False
+
+    def total(self):
+        '''The same statistics as Pomodoro.finish gives'''
+        n = len(self.durations)
+        achieved = self.combos[self.achieved]
+        return {
+            'achieved': int(self.achieved.sum()),
+            'aborted': int(self.aborted.sum()),
+            # The first interval is taken as an interrupt, as Pomodoro does.
+            'interrupt': int(self.interrupt.sum()) + (1 if n else 0),
+            'seconds': float(self.durations.sum()),
+            'max_combo': int(achieved.max()) if len(achieved) else 0,
+            'combo': int(self.combos[-1]) if n and not self.combo_resets[
+                -1] else 0,
+        }
+
+    def histograms(self, period):
+        '''Counters by local day or by local hour of day'''
+        offset = time.timezone
+        events = self.ends - offset
+        starts = self.starts - offset
+        if period == 'day':
+            events, starts = events // 86400, starts // 86400
+            first = min(events.min(), starts.min()) if len(events) else 0
+            size = max(events.max(), starts.max()) + 1 - first if len(
+                events) else 0
+            keys = (first + np.arange(size)).astype('M8[D]').astype(str)
+        else:
+            events, starts = events % 86400 // 3600, starts % 86400 // 3600
+            first, size = 0, 24
+            keys = np.arange(24)
+        events, starts = events - first, starts - first
+
+        interrupt_at = events[self.interrupt]
+        if len(starts):
+            # The first interval counts as an interrupt at its start.
+            interrupt_at = np.append(starts[0], interrupt_at)
+        max_combo = np.zeros(size, dtype=np.int64)
+        np.maximum.at(
+            max_combo, events[self.achieved], self.combos[self.achieved])
+        columns = {
+            'achieved': np.bincount(events[self.achieved], minlength=size),
+            'aborted': np.bincount(events[self.aborted], minlength=size),
+            'interrupt': np.bincount(interrupt_at, minlength=size),
+            'seconds': np.bincount(
+                starts, weights=self.durations, minlength=size),
+            'max_combo': max_combo,
+        }
+        return [
+            dict(
+                [(period, k.item() if hasattr(k, 'item') else k)] +
+                [(c, columns[c][i].item()) for c in COUNTERS])
+            for i, k in enumerate(keys)]
+
+    def streaks(self):
+        '''Combos of achieved pomodoroes, from the first to the last one'''
+        idx = np.flatnonzero(self.achieved)
+        last = np.append(-1, group_starts(self.combo_resets)[:-1])[idx]
+        _, first, counts = np.unique(
+            last, return_index=True, return_counts=True)
+        return [
+            {
+                'start': utils.epoch2local(int(self.ends[idx[i]])).isoformat(),
+                'end': utils.epoch2local(
+                    int(self.ends[idx[i + c - 1]])).isoformat(),
+                'combo': int(self.combos[idx[i + c - 1]]),
+            }
+            for i, c in zip(first.tolist(), counts.tolist())]
+
+
+def load(entries, now):
+    '''Arrays of the starts and the ends of intervals in Pomodoro Mode'''
+    starts, ends, opened = [], [], False
+    for entry in entries:
+        if settings.POMODORO_TAG in entry['tags']:
+            starts.append(entry['start'])
+            ends.append(entry.get('end', entry['start']))
+            opened = 'end' not in entry
+    starts, ends = parse_epochs(starts), parse_epochs(ends)
+    if opened:
+        ends[-1] = now
+    return starts, ends
+
+
+def write_csv(out, stats):
+    out.write('period,key,%s\n' % ','.join(COUNTERS))
+    for period in ('day', 'hour'):
+        for row in stats[period + 's']:
+            out.write('%s,%s,%s\n' % (
+                period, row[period], ','.join(str(row[c]) for c in COUNTERS)))
+
+
+def main():
+    if np is None:
+        exit('pomo_analytics.py requires NumPy: pip install numpy')
+    now = int(time.time())
+    with tracing.phase('read'):
+        configs, entries = utils.format_inputs()
+        intervals = load(entries, now)
+    with tracing.phase('compute'):
+        analytics = Analytics(*intervals, now)
+        stats = {
+            'total': analytics.total(),
+            'days': analytics.histograms('day'),
+            'hours': analytics.histograms('hour'),
+            'streaks': analytics.streaks(),
+        }
+    report = configs.get('reports', {}).get('pomo_analytics', {})
+    with tracing.phase('write'):
+        try:
+            if report.get('format') == 'csv':
+                write_csv(sys.stdout, stats)
+            else:
+                print(json.dumps(stats, indent=2))
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # The reader, like `head`, has had enough.
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,61 @@
 #!/usr/bin/env python3.10
 
-from pomo_stat import stat
-
-
-pomos = stat()
-content = (
-    "[POMO] "
-    + {
-        "ACTIVE": "Active-%(combo)s: %(desc)s",
-        "INTERRUPT": "Interrupt-%(combo)s: %(desc)s",
-        "COMPLETE": "Complete. Achieved: %(achieved)d, Combo: %(combo)d",
-        "INACTIVE": "Inactive. Achieved: %(achieved)d, MaxCombo: %(max_combo)d",
-    }.get(pomos["status"], "%(status)s, Combo: %(combo)d")
-    % pomos
-)
-print(content)
+import os
+import sys
+import json
+
+
+# Where pomo_server.py listens.
+SOCKET_PATH = os.getenv('POMODORO_SOCKET') or os.path.join(
+    os.getenv('XDG_RUNTIME_DIR') or '/tmp',
+    'pomodoro-warriors-%s.sock' % os.getuid())
+TEMPLATES = {
+    "ACTIVE": "Active-%(combo)s: %(desc)s",
+    "INTERRUPT": "Interrupt-%(combo)s: %(desc)s",
+    "COMPLETE": "Complete. Achieved: %(achieved)d, Combo: %(combo)d",
+    "INACTIVE": "Inactive. Achieved: %(achieved)d, MaxCombo: %(max_combo)d",
+}
+
+
+def message(pomos):
+    return (
+        "[POMO] "
+        + TEMPLATES.get(pomos["status"], "%(status)s, Combo: %(combo)d") % pomos
+    )
+
+
+def query(args, timeout=0.5):
+    """Ask pomo_server.py for the statistics of the range `args`"""
+    import socket
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(SOCKET_PATH)
+        client.sendall(json.dumps(args).encode("utf-8") + b"\n")
+        chunks = []
+        while chunk := client.recv(4096):
+            chunks.append(chunk)
+        return json.loads(b"".join(chunks))
+    except (OSError, ValueError):
+        return None
+    finally:
+        client.close()
+
+
+def main():
+    if len(sys.argv) > 1:
+        # `pomo_msg.py :day` asks the server and falls back to timewarrior.
+        pomos = query(sys.argv[1:])
+        if pomos is None:
+            os.execvp("timew", ["timew", "pomo_msg.py"] + sys.argv[1:])
+    else:
+        # `timew pomo_msg.py :day`
+        from pomo_stat import stat
+
+        pomos = stat()
+    print(message(pomos))
+
+
+if __name__ == "__main__":
+    main()
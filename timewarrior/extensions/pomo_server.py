@@ -0,0 +1,118 @@
+'''
+Keep the statistics of Pomodoro Mode in memory and serve them over a Unix
+socket, so that status-lines refreshing `pomo_msg.py :day` every few seconds
+don't spawn timewarrior and python over and over again.
+
+    python3 ~/.timewarrior/extensions/pomo_server.py &
+
+Intervals are exported again only after the data of timewarrior changes.
+'''
+
+import os
+import json
+import signal
+import time
+import socket
+import datetime
+import subprocess
+import socketserver
+
+import utils
+from utils import settings
+from pomo_msg import SOCKET_PATH
+from pomo_stat import Pomodoro, describe
+
+
+def data_stamp():
+    '''Changes whenever timewarrior writes its data or a new day comes'''
+    datadir = os.path.join(settings.TIMEWARRIOR_DB, 'data')
+    return (datetime.date.today(), tuple(
+        (e.name, e.stat().st_mtime_ns, e.stat().st_size)
+        for e in os.scandir(datadir) if e.name.endswith('.data')))
+
+
+class Range:
+    '''The state of Pomodoro Mode in a range like `:day`'''
+
+    def __init__(self, args):
+        self.args, self.stamp = args, None
+
+    def refresh(self):
+        stamp = data_stamp()
+        if stamp == self.stamp:
+            return
+        proc = subprocess.Popen(
+            ['timew', 'export'] + self.args,
+            encoding='utf-8',
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)
+        pomodoro, opened = Pomodoro(), None
+        with proc.stdout:
+            for entry in utils.iter_json_array(proc.stdout):
+                if settings.POMODORO_TAG not in entry['tags']:
+                    continue
+                if 'end' not in entry:
+                    opened = entry
+                    break
+                pomodoro.feed(
+                    utils.parse_epoch(entry['start']),
+                    utils.parse_epoch(entry['end']),
+                    entry['tags'])
+        proc.wait()
+        self.pomodoro, self.opened = pomodoro, opened
+        self.desc = describe(opened['tags'] if opened else pomodoro.tags)
+        self.stamp = stamp
+
+    def stat(self):
+        self.refresh()
+        now, pomodoro = int(time.time()), self.pomodoro
+        if self.opened:
+            pomodoro = pomodoro.copy()
+            pomodoro.feed(
+                utils.parse_epoch(self.opened['start']), now,
+                self.opened['tags'])
+        ret = pomodoro.finish(now)
+        ret['desc'] = self.desc
+        return ret
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        args = json.loads(line)
+        key = tuple(args)
+        if key not in self.server.ranges:
+            self.server.ranges[key] = Range(args)
+        self.wfile.write(
+            json.dumps(self.server.ranges[key].stat()).encode('utf-8'))
+
+
+def running():
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(SOCKET_PATH)
+        return True
+    except OSError:
+        return False
+    finally:
+        client.close()
+
+
+def main():
+    if running():
+        exit('pomo_server.py is already running.')
+    if os.path.exists(SOCKET_PATH):
+        os.remove(SOCKET_PATH)
+    server = socketserver.UnixStreamServer(SOCKET_PATH, Handler)
+    server.ranges = {}
+    signal.signal(signal.SIGTERM, lambda *args: exit())
+    try:
+        server.serve_forever()
+    finally:
+        os.remove(SOCKET_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,62 @@
 #!/usr/bin/python
 
+import os
 import json
-import datetime
-import subprocess
+import time
 
 import utils
 from utils import settings
 
 
-def stat():
-    _, entries = utils.format_inputs()
-    entries = [
-        entry for entry in entries if settings.POMODORO_TAG in entry['tags']]
-    ret = {
-        'status': 'INACTIVE',  # ACTIVE|INTERRUPT|COMPLETE|INACTIVE|BREAK
-        'desc': '',            # Description of last tracked task
-        'seconds': 0.0,        # Total tracking seconds in Pomodoro Mode
-        'interrupt': 0,        # Times of interruptions
-        'aborted': 0,          # The count of aborted pomodoroes
-        'achieved': 0,         # The count of achieved pomodoroes
-        'combo': 0,            # The count of archieved pomodoroes in combo
-        'max_combo': 0         #
-    }
-    if not entries:
-        return ret
-
-    seconds, end, now = 0.0, None, datetime.datetime.now()
-    for entry in entries + [{}]:
-        start = utils.parse_utc(entry['start']) if 'start' in entry else now
-        gap = (start - end).total_seconds() if end else 0.0
+CHECKPOINT_PATH = os.path.join(settings.CACHE_DIR, 'pomo_stat.json')
+# Checkpoints of the latest ranges requested are kept.
+CHECKPOINT_RANGES = 8
+
+
+class Pomodoro:
+    '''
+    The state machine of Pomodoro Mode.
+
+    Tracked intervals are fed in order with `feed` and `finish` tells the
+    state at a moment later than all of them. Moments are seconds since the
+    epoch. As the state can be dumped and
+    restored, intervals fed once never have to be replayed.
+    '''
+
+    def __init__(self, state=None):
+        self.ret = {
+            'status': 'INACTIVE',  # ACTIVE|INTERRUPT|COMPLETE|INACTIVE|BREAK
+            'desc': '',            # Description of last tracked task
+            'seconds': 0.0,        # Total tracking seconds in Pomodoro Mode
+            'interrupt': 0,        # Times of interruptions
+            'aborted': 0,          # The count of aborted pomodoroes
+            'achieved': 0,         # The count of achieved pomodoroes
+            'combo': 0,            # The count of archieved pomodoroes in combo
+            'max_combo': 0         #
+        }
+        self.seconds, self.end, self.tags = 0.0, None, []
+        if state:
+            self.ret.update(state['ret'])
+            self.seconds, self.tags = state['seconds'], state['tags']
+            self.end = state['end']
+
+    def dump(self):
+        return {
+            'ret': self.ret,
+            'seconds': self.seconds,
+            'tags': self.tags,
+            'end': self.end,
+        }
+
+    def copy(self):
+        other = Pomodoro()
+        other.ret = dict(self.ret)
+        other.seconds, other.end, other.tags = self.seconds, self.end, self.tags
+        return other
+
+    def step(self, start):
+        ret, end, seconds = self.ret, self.end, self.seconds
+        gap = start - end if end else 0.0
         if start == end:
             ret['seconds'] += seconds
             if seconds < settings.POMODORO_DURATION:
@@ -57,25 +85,121 @@ def stat():
             if ret['max_combo'] < ret['combo']:
                 ret['max_combo'] = ret['combo']
             seconds = 0.0
-            break2 = end + datetime.timedelta(seconds=(
+            break2 = end + (
                 settings.POMODORO_SHORT_BREAK
                 if ret['combo'] % settings.POMODORO_SET_COUNT
-                else settings.POMODORO_LONG_BREAK))
-            if (start - break2).total_seconds() >= settings.POMODORO_COMBO_GAP:
+                else settings.POMODORO_LONG_BREAK)
+            if start - break2 >= settings.POMODORO_COMBO_GAP:
                 ret['combo'] = 0
                 ret['status'] = 'INACTIVE'
             else:
-                ret['status'] = break2.strftime('BREAK TO %H:%M')
-        end = utils.parse_utc(entry['end']) if 'end' in entry else now
-        seconds += (end - start).total_seconds()
-    else:
-        ret['seconds'] += seconds
+                ret['status'] = utils.epoch2local(break2).strftime(
+                    'BREAK TO %H:%M')
+        self.seconds = seconds
+
+    def feed(self, start, end, tags):
+        self.step(start)
+        self.seconds += end - start
+        self.end, self.tags = end, tags
+
+    def finish(self, now):
+        '''Return the statistics at `now` leaving the state untouched'''
+        other = self.copy()
+        if other.end:
+            other.step(now)
+            other.ret['seconds'] += other.seconds
+        return other.ret
+
+
+def load_checkpoint(key):
+    try:
+        with open(CHECKPOINT_PATH) as f:
+            return json.load(f).get(key)
+    except (IOError, ValueError):
+        return None
 
-    for tag in entries[-1]['tags']:
+
+def save_checkpoint(key, checkpoint):
+    try:
+        with open(CHECKPOINT_PATH) as f:
+            checkpoints = json.load(f)
+    except (IOError, ValueError):
+        checkpoints = {}
+    checkpoints.pop(key, None)
+    checkpoints[key] = checkpoint
+    while len(checkpoints) > CHECKPOINT_RANGES:
+        checkpoints.pop(next(iter(checkpoints)))
+    os.makedirs(settings.CACHE_DIR, exist_ok=True)
+    tmp = '%s.%s' % (CHECKPOINT_PATH, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(checkpoints, f)
+    os.replace(tmp, CHECKPOINT_PATH)
+
+
+def describe(tags):
+    '''Description of the task tracked with `tags`'''
+    for tag in tags:
         if utils.is_uuid(tag):
-            ret['desc'] = subprocess.getoutput('task _get %s.description' % tag)
+            return utils.load_tasks([tag]).get(tag, {}).get('description', '')
+    return ''
+
+
+def replay(pomodoro, intervals):
+    for interval in intervals:
+        pomodoro.feed(*interval)
+    return interval
+
+
+def stat():
+    import hashlib
+
+    configs, entries = utils.format_inputs(stream=True)
+    report = configs.get('temp', {}).get('report', {})
+    key = '%s %s' % (settings.POMODORO_TAG, report.get('start', ''))
+    now = int(time.time())
+
+    # Resume from the state after the closed intervals seen before,
+    # provided that none of them has changed since, which is told by a
+    # digest of them all. They are kept until then in case one has.
+    checkpoint = load_checkpoint(key) or {'count': 0}
+    pomodoro, skipped, closed, opened, count = Pomodoro(), [], None, None, 0
+    digest = hashlib.sha1()
+    for entry in entries:
+        if settings.POMODORO_TAG not in entry['tags']:
+            continue
+        if 'end' not in entry:
+            opened = (utils.parse_epoch(entry['start']), now, entry['tags'])
             break
+        count += 1
+        interval = (
+            utils.parse_epoch(entry['start']), utils.parse_epoch(entry['end']),
+            entry['tags'])
+        digest.update(json.dumps(interval).encode('utf-8'))
+        if count < checkpoint['count']:
+            skipped.append(interval)
+        elif count == checkpoint['count']:
+            if digest.hexdigest() == checkpoint.get('digest'):
+                pomodoro = Pomodoro(checkpoint['state'])
+            else:
+                skipped.append(interval)
+                closed = replay(pomodoro, skipped)
+            skipped = None
+        else:
+            closed = replay(pomodoro, [interval])
+    if skipped:
+        closed = replay(pomodoro, skipped)
+    if closed:
+        save_checkpoint(key, {
+            'count': count,
+            'digest': digest.hexdigest(),
+            'state': pomodoro.dump(),
+        })
 
+    if opened:
+        pomodoro = pomodoro.copy()
+        replay(pomodoro, [opened])
+    ret = pomodoro.finish(now)
+    ret['desc'] = describe(pomodoro.tags)
     return ret
 
 
@@ -1,13 +1,67 @@
 #!/usr/bin/env python3.10
 
+import time
 import datetime
+import collections
 
-import utils, copy
+import utils
+from utils import tracing
 import sys
-import re, json, subprocess
 
-SINGLE_KEY_SIZE = 1
-FIRST_ENTRY = 0
+
+class ProjectNode:
+    """A project with the totals of itself and of its subprojects"""
+
+    def __init__(self, name):
+        self.name = name
+        self.children = dict()
+        self.tasks = dict()  # Seconds of the tasks directly in the project
+        self.self_seconds = 0
+        self.seconds = 0
+        self.task_count = 0
+
+
+class ProjectTree:
+    """
+    Dotted projects arranged in a prefix tree. The seconds of an interval in
+    `a.b.c` are added to `a`, `a.b` and `a.b.c` at once.
+    """
+
+    def __init__(self):
+        self.root = ProjectNode("")
+        self.paths = dict()
+
+    def path(self, project):
+        """Nodes from the top-level project down to `project`"""
+        if project not in self.paths:
+            node, path = self.root, []
+            for name in project.split("."):
+                if name not in node.children:
+                    node.children[name] = ProjectNode(
+                        f"{node.name}.{name}" if node.name else name
+                    )
+                node = node.children[name]
+                path.append(node)
+            self.paths[project] = path
+        return self.paths[project]
+
+    def add(self, project, uuid, seconds):
+        path = self.path(project)
+        leaf = path[-1]
+        new_task = uuid not in leaf.tasks
+        leaf.self_seconds += seconds
+        leaf.tasks[uuid] = leaf.tasks.get(uuid, 0) + seconds
+        for node in path:
+            node.seconds += seconds
+            node.task_count += new_task
+
+    def walk(self, node=None, depth=0):
+        """Yield (depth, node) of all projects depth-first by name"""
+        node = node or self.root
+        for name in sorted(node.children):
+            child = node.children[name]
+            yield depth, child
+            yield from self.walk(child, depth + 1)
 
 
 class TimeReport:
@@ -15,35 +69,60 @@ class TimeReport:
     projects = dict()
     duration = datetime.timedelta()
     start = end = None
+    loaded = dict()
+    jrnl_logs = iter(())
+    fetched_jrnl_logs = dict()
+    project_tree = ProjectTree()
+
+    def load_tasks(self, ids):
+        """Fetch the tasks of all given ids at once"""
+        self.loaded.update(utils.load_tasks(ids))
+
+    def prefetch_jrnl_logs(self, table):
+        """Start asking logs for the runs of intervals of the same task"""
+        runs = []
+        for i in range(len(table)):
+            uuid = table.uuid(i)
+            if runs and runs[-1][0] == uuid:
+                runs[-1][2] = utils.epoch2local(table.ends[i])
+            elif uuid:
+                runs.append(
+                    [
+                        uuid,
+                        utils.epoch2local(table.starts[i]),
+                        utils.epoch2local(table.ends[i]),
+                    ]
+                )
+        self.jrnl_logs = zip(map(tuple, runs), utils.iter_jrnl_logs(runs))
+        self.fetched_jrnl_logs = dict()
 
     def getJrnlLogs(self, taskid, from_date, to_date):
-        jrnl_args = f"--short -from {from_date.strftime('%Y-%m-%dT%H:%M')} -to {to_date.strftime('%Y-%m-%dT%H:%M:%S')}"
-        command = f'taskopen jrnl --args="{jrnl_args}" --active-tasks="" {taskid}'
-        jrnl_logs = subprocess.run(
-            command,
-            shell=True,
-            encoding="utf-8",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-        )
-        return (
-            jrnl_logs.stdout if jrnl_logs.stdout != "No actions applicable.\n" else None
-        )
+        """Logs of a run, kept by query when others are asked first"""
+        key = (taskid, from_date, to_date)
+        if key in self.fetched_jrnl_logs:
+            return self.fetched_jrnl_logs.pop(key)
+        for query, logs in self.jrnl_logs:
+            if query == key:
+                return logs
+            self.fetched_jrnl_logs[query] = logs
+        return utils.jrnl_logs(taskid, from_date, to_date)
 
     def getProjectForTaskId(self, id):
         project = None
 
         if id not in self.tasks:
-            tmp_tasks = json.loads(subprocess.check_output(["task", id, "export"]))
-            if len(tmp_tasks) > 0:
-                self.tasks[id] = tmp_tasks[FIRST_ENTRY]
+            if id not in self.loaded:
+                self.loaded.update(utils.load_tasks([id]))
+            if id in self.loaded:
+                self.tasks[id] = dict(self.loaded[id])
                 task = self.tasks[id]
-                if "project" not in tmp_tasks[FIRST_ENTRY]:
+                if "project" not in task:
                     task["project"] = "NONE"
                 project = task["project"]
             else:
                 project = "NOT FOUND"
                 task = {"description": id, "project": "NOT FOUND", "status": "unknown"}
+                self.tasks[id] = task
             if project not in self.projects:
                 self.projects[project] = dict()
                 self.projects[project]["duration"] = datetime.timedelta(0)
@@ -100,43 +179,97 @@ class TimeReport:
         print("-" * 135)
 
     def print_project_report(self):
-        for project, details in self.projects.items():
-            pduration = details["duration"]
-            print(f"{project}")
-            for task, task_data in details["members"].items():
-                if len(task_data["description"]) < 65:
+        for depth, node in self.project_tree.walk():
+            indent = "  " * depth
+            print(f"{indent}{node.name}")
+            for task, seconds in node.tasks.items():
+                task_data = self.tasks[task]
+                duration = datetime.timedelta(seconds=seconds)
+                segments = len(task_data["description"]) // 65
+                for i in range(segments):
                     print(
-                        f"\t{task_data['description'][:65].ljust(70)}{task_data['status'].upper().ljust(13)}{task_data['duration']}"
+                        f"\t{indent}{task_data['description'][(65 * i) : (65 * (i + 1))]}..."
                     )
-                else:
-                    segments = len(task_data["description"]) // 65
-                    for i in range(segments):
-                        print(
-                            f"\t{task_data['description'][(65 * i) : (65 * (i + 1))]}..."
-                        )
-                    print(
-                        f"\t{task_data['description'][65 * segments :].ljust(70)}{task_data['status'].upper().ljust(13)}{task_data['duration']}"
-                    )
-            print(f"{str(pduration).rjust(108)}")
+                print(
+                    f"\t{indent}{task_data['description'][65 * segments :].ljust(70 - len(indent))}{task_data['status'].upper().ljust(13)}{duration}"
+                )
+            summary = (
+                f"{indent}{node.task_count} tasks, "
+                f"self {datetime.timedelta(seconds=node.self_seconds)}, total"
+            )
+            total = str(datetime.timedelta(seconds=node.seconds))
+            print(f"{summary}{total.rjust(108 - len(summary))}")
             self.print_project_separator()
         self.print_report_separator()
         self.print_total_time()
 
 
-# TODO: Finish nesteed values. How to handle when project has task and also subprojects? Two different keys must be used
-def get_nested_value(dictionary, key, sep=".", default=None):
-    keys = key.split(sep)
-    first_level = dictionary.get(keys[FIRST_ENTRY], default)
-    if len(keys) > SINGLE_KEY_SIZE:
-        next_keys = sep.join(keys[SINGLE_KEY_SIZE:])
-        return get_nested_value(first_level)
-    else:
-        return first_level
+def tree_report(time_report, table):
+    """Roll the intervals up into the tree of projects in a single pass"""
+    for i in range(len(table)):
+        seconds = table.ends[i] - table.starts[i]
+        time_report.duration += datetime.timedelta(seconds=seconds)
+        uuid = table.uuid(i)
+        if not uuid:
+            print(
+                "Task UUID not found. Is the format right?\n\t%s"
+                % table.tags_of(i),
+                file=sys.stderr,
+            )
+            continue
+        project = time_report.getProjectForTaskId(uuid)
+        time_report.project_tree.add(project, uuid, seconds)
+    if len(table):
+        time_report.start = utils.epoch2local(table.starts[0])
+        time_report.end = utils.epoch2local(table.ends[len(table) - 1])
+    with tracing.phase("render"):
+        time_report.print_project_report()
+
+
+def rollup_report(time_report, configs):
+    """Total the tree of projects from the rollups of the days in the range"""
+    report = configs.get("temp", {}).get("report", {})
+    start, end = (
+        utils.parse_epoch(report[k]) if report.get(k) else None
+        for k in ("start", "end")
+    )
+    now = int(time.time())
+    with tracing.phase("read"):
+        rows = utils.rollup(start, end, now, utils.data_dir(configs))
+    seconds = collections.Counter()
+    for _, uuid, secs, _ in rows:
+        seconds[uuid] += secs
+    untracked = seconds.pop("", 0)
+    if untracked:
+        print(
+            "%s tracked without a task UUID" % datetime.timedelta(seconds=untracked),
+            file=sys.stderr,
+        )
+    time_report.load_tasks(seconds)
+    for uuid, secs in seconds.items():
+        time_report.duration += datetime.timedelta(seconds=secs)
+        project = time_report.getProjectForTaskId(uuid)
+        time_report.project_tree.add(project, uuid, secs)
+    if start is not None:
+        time_report.start = utils.epoch2local(start)
+    elif rows:
+        time_report.start = datetime.datetime.strptime(rows[0][0], "%Y-%m-%d")
+    time_report.end = utils.epoch2local(now if end is None else min(end, now))
+    with tracing.phase("render"):
+        time_report.print_project_report()
 
 
 def main():
-    _, entries = utils.format_inputs()
-    now = datetime.datetime.now()
+    configs, entries = utils.format_inputs(stream=True)
+    # `timew project.py rc.reports.project.tree=on` totals by project instead
+    tree = configs.get("reports", {}).get("project", {}).get("tree", "off")
+    tree = tree.lower() in ("on", "yes", "y", "true", "1")
+    # `timew project.py rc.reports.project.format=jsonl` or `csv` exports the rows
+    fmt = utils.export_format(configs, "project")
+    # Without tags to filter by, the totals of past days are kept in a cache.
+    if tree and not fmt and not configs.get("temp", {}).get("report", {}).get("tags"):
+        utils.skip_inputs()
+        return rollup_report(TimeReport(), configs)
     task_project_map, task_duration = dict(), dict()
     time_report = TimeReport()
     duration = datetime.timedelta()
@@ -144,22 +277,28 @@ def main():
     switchProject = False
     project = taskid = None
 
-    for entry in entries:
-        start = utils.parse_utc(entry["start"])
-        end = utils.parse_utc(entry["end"]) if "end" in entry else now
+    with tracing.phase("read"):
+        table = utils.IntervalTable.from_entries(entries)
+        time_report.load_tasks(table.uuids())
+    if fmt:
+        rows = utils.iter_export_rows(table, time_report.loaded)
+        with tracing.phase("export"):
+            return utils.write_export(sys.stdout, rows, fmt)
+    if tree:
+        return tree_report(time_report, table)
+    time_report.prefetch_jrnl_logs(table)
+    for i in range(len(table)):
+        start = utils.epoch2local(table.starts[i])
+        end = utils.epoch2local(table.ends[i])
         time_report.duration += end - start
-        matches = [
-            tag
-            for tag in entry["tags"]
-            if re.match(r"^[\d\w]{8}-([\d\w]{4}-){3}[\d\w]{12}$", tag)
-        ]
-        if matches:
-            if matches[FIRST_ENTRY] != taskid:
+        uuid = table.uuid(i)
+        if uuid:
+            if uuid != taskid:
                 if project and taskid:
                     time_report.print_task_data(taskid)
                 else:
                     time_report.start = start
-                taskid = matches[FIRST_ENTRY]
+                taskid = uuid
                 if project != time_report.getProjectForTaskId(taskid):
                     if project:
                         print(f"\t{end} {str(duration).rjust(106)}")
@@ -170,7 +309,8 @@ def main():
                 time_report.tasks[taskid]["start"] = start
         else:
             print(
-                "Task UUID not found. Is the format right?\n\t%s" % str(entry),
+                "Task UUID not found. Is the format right?\n\t%s"
+                % table.tags_of(i),
                 file=sys.stderr,
             )
             taskid = "NOT UUID"
@@ -186,13 +326,9 @@ def main():
         time_report.tasks[taskid]["end"] = end
         time_report.print_task_data(taskid)
         print(f"\t{end} {str(duration).rjust(106)}")
-    taskid = matches[FIRST_ENTRY]
 
     time_report.print_report_separator()
     time_report.print_total_time()
 
 
-# time_report.print_project_report()
-
-
 main()
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3.10
 
-import shutil
+import io
+import itertools
 import datetime
 
-import utils, copy
-import sys, os
-import re, json, subprocess
+import utils
+from utils import tracing
+import sys
+import json, subprocess
 
 SINGLE_KEY_SIZE = 1
 FIRST_ENTRY = 0
@@ -16,19 +18,7 @@ ENABLE_LOGS = False
 class JrnlReport:
     @staticmethod
     def get_logs(taskid, from_date, to_date):
-        jrnl_args = f"--export json -from {from_date.strftime('%Y-%m-%dT%H:%M')} -to {to_date.strftime('%Y-%m-%dT%H:%M:%S')}"
-        jrnl_args = f"--short -from {from_date.strftime('%Y-%m-%dT%H:%M')} -to {to_date.strftime('%Y-%m-%dT%H:%M:%S')}"
-        command = f'taskopen jrnl --args="{jrnl_args}" --active-tasks="" {taskid}'
-        jrnl_logs = subprocess.run(
-            command,
-            shell=True,
-            encoding="utf-8",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-        )
-        return (
-            jrnl_logs.stdout if jrnl_logs.stdout != "No actions applicable.\n" else None
-        )
+        return utils.jrnl_logs(taskid, from_date, to_date)
 
 
 class TimeReport:
@@ -39,19 +29,7 @@ class TimeReport:
 
     @staticmethod
     def getJrnlLogs(taskid, from_date, to_date):
-        jrnl_args = f"--export json -from {from_date.strftime('%Y-%m-%dT%H:%M')} -to {to_date.strftime('%Y-%m-%dT%H:%M:%S')}"
-        jrnl_args = f"--short -from {from_date.strftime('%Y-%m-%dT%H:%M')} -to {to_date.strftime('%Y-%m-%dT%H:%M:%S')}"
-        command = f'taskopen jrnl --args="{jrnl_args}" --active-tasks="" {taskid}'
-        jrnl_logs = subprocess.run(
-            command,
-            shell=True,
-            encoding="utf-8",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-        )
-        return (
-            jrnl_logs.stdout if jrnl_logs.stdout != "No actions applicable.\n" else None
-        )
+        return utils.jrnl_logs(taskid, from_date, to_date)
 
     def getProjectForTaskId(self, id):
         project = None
@@ -160,136 +138,114 @@ def get_nested_value(dictionary, key, sep=".", default=None):
 class ReportProcessor:
     tasks = dict()
     config = dict()
-    timew_entries = []
+    table = None
 
     strfdate = "W%U %Y-%m-%d %a"
     strftime = "%H:%M:%S"
+    line_format = "{:<19s}{:<100s}{:<9s}{}\n"
 
     def __init__(self):
-        self.config, self.timew_entries = utils.format_inputs()
+        self.config, entries = utils.format_inputs(stream=True)
+        self.table = utils.IntervalTable.from_entries(entries)
         self.load_task_data()
 
     def cols_to_line(
         self, date=None, activity=None, duration=None, period_duration=None
     ):
-        return "{:<19s}{:<100s}{:<9s}{}".format(
+        return self.line_format.format(
             date or "", activity or "", duration or "", period_duration or ""
         )
 
     def __str__(self):
         """Output the current report as a string"""
-        report = ""
+        report = io.StringIO()
+        self.render(report)
+        return report.getvalue()
+
+    def render(self, out):
+        """Write the current report to `out` line by line"""
+        write, line = out.write, self.cols_to_line
         last_entry = None
         last_project = None
         task_duration = datetime.timedelta()
-        project_duration = datetime.timedelta()
-        day_duration = datetime.timedelta()
-        week_duration = datetime.timedelta()
-        month_duration = datetime.timedelta()
         total_duration = datetime.timedelta()
         last_date = None
+        # The date key and time column only change with the calendar day.
+        day, day_key = None, None
+
+        entries = self.entries()
+        if ENABLE_LOGS:
+            entries, queries = itertools.tee(entries)
+            logs = utils.iter_jrnl_logs(
+                (entry.uuid, entry.start, entry.end) for entry in queries
+            )
+        else:
+            logs = itertools.repeat(None)
 
-        for entry in self.timew_entries:
+        for entry, jrnl_logs in zip(entries, logs):
+            if day != entry.start.toordinal():
+                day = entry.start.toordinal()
+                day_key = entry.start.strftime(self.strfdate)
             project = self.tasks[entry.uuid].get("project", "")
-            if last_project != project or last_date != entry.start.strftime(
-                self.strfdate
-            ):
-                if (report_date := entry.start.strftime(self.strfdate)) == last_date:
+            if last_project != project or last_date != day_key:
+                if day_key == last_date:
                     report_date = ""
                 else:
-                    last_date = entry.start.strftime(self.strfdate)
+                    report_date = last_date = day_key
                 # Append project line
-                report += (
-                    self.cols_to_line(report_date, "{:<0s}{}".format("", project))
-                    + "\n"
-                )
+                write(line(report_date, project))
                 last_project = project
 
             if not last_entry or not last_entry.on_same_day(entry):
-                cur_date = entry.start
-                task_duration += entry.end - entry.start
+                task_duration += entry.duration
             else:
-                task_duration = entry.end - entry.start
+                task_duration = entry.duration
 
-            total_duration += entry.end - entry.start
-            if (report_date := entry.start.strftime(self.strfdate)) == last_date:
-                report_date = "{:>14s}".format(entry.start.strftime("%H:%M"))
+            total_duration += entry.duration
             # Append Task line
-            report += (
-                self.cols_to_line(
-                    report_date,
+            write(
+                line(
+                    "{:>14s}".format(entry.start.strftime("%H:%M")),
                     "{:<2s}{}\t{}".format("", entry.status, entry),
                     str(task_duration),
                 )
-                + "\n"
             )
 
-            if ENABLE_LOGS and (
-                jrnl_logs := JrnlReport.get_logs(entry.uuid, entry.start, entry.end)
-            ):
-                for line in jrnl_logs.splitlines():
+            if jrnl_logs:
+                for jrnl_line in jrnl_logs.splitlines():
                     # Append jrnl line
-                    report += (
-                        self.cols_to_line(None, "{:<4s}{}".format("", line)) + "\n"
-                    )
+                    write(line(None, "{:<4s}{}".format("", jrnl_line)))
 
             last_entry = entry
 
-        report += self.cols_to_line(period_duration="      ") + "\n"
-        report += self.cols_to_line(period_duration=str(total_duration)) + "\n"
-        return report
+        write(line(period_duration="      "))
+        write(line(period_duration=str(total_duration)))
 
     def load_task_data(self):
-        uuids = []
-        for idx, entry in enumerate(self.timew_entries):
-            self.timew_entries[idx] = TimewEntry(entry)
-            if self.timew_entries[idx].uuid:
-                uuids.append(self.timew_entries[idx].uuid)
-
-        command = "task {} export".format(" ".join(self.tasks.keys()))
-        output = subprocess.run(
-            command,
-            encoding="UTF-8",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-        )
-
-        tasks = json.loads(output.stdout)
-
-        for task in tasks:
-            self.tasks[task["uuid"]] = task
+        self.tasks.update(utils.load_tasks(self.table.uuids()))
 
-        for idx, entry in enumerate(self.timew_entries):
+    def entries(self):
+        """Yield the intervals one by one with their task data"""
+        for idx in range(len(self.table)):
+            entry = TimewEntry(self.table, idx)
             try:
-                self.timew_entries[idx].description = self.tasks[entry.uuid][
-                    "description"
-                ]
-                self.timew_entries[idx].status = self.tasks[entry.uuid][
-                    "status"
-                ].upper()
+                entry.description = self.tasks[entry.uuid]["description"]
+                entry.status = self.tasks[entry.uuid]["status"].upper()
             except Exception as exception:
                 pass
+            yield entry
 
 
 class TimewEntry:
     uuid = None
     _desc = None
 
-    def __init__(self, entry):
-        self.start = utils.parse_utc(entry["start"])
-        self.end = (
-            utils.parse_utc(entry["end"]) if "end" in entry else datetime.datetime.now()
-        )
+    def __init__(self, table: utils.IntervalTable, idx: int):
+        self.start = utils.epoch2local(table.starts[idx])
+        self.end = utils.epoch2local(table.ends[idx])
         self.duration = self.end - self.start
-        self.tags = entry["tags"]
-        matches = [
-            tag
-            for tag in entry["tags"]
-            if re.match(r"^[\d\w]{8}-([\d\w]{4}-){3}[\d\w]{12}$", tag)
-        ]
-        if matches:
-            self.uuid = matches[FIRST_ENTRY]
+        self.tags = table.tags_of(idx)
+        self.uuid = table.uuid(idx)
 
     def on_same_day(self, entry: "TimewEntry"):
         return self.start.toordinal() == entry.start.toordinal()
@@ -309,23 +265,21 @@ class TimewEntry:
         return str(self).__format__(format_spec)
 
     def __str__(self):
-        try:
-            terminal_width = os.get_terminal_size().columns
-        except:
-            terminal_width = 150
-
-        # Calculate the available space for the UUID field
-        # Adjust these values if needed
-        other_fields_width = 53  # Approximate width for other fields
-        desc_field_width = terminal_width - other_fields_width
-
-        return f"%s" % (self.description)
+        return self.description
 
 
 def main():
-    report = ReportProcessor()
-
-    print(report)
+    with tracing.phase("read"):
+        report = ReportProcessor()
+    # `timew task.py rc.reports.task.format=jsonl` or `csv` exports the rows
+    fmt = utils.export_format(report.config, "task")
+    if fmt:
+        rows = utils.iter_export_rows(report.table, report.tasks)
+        with tracing.phase("export"):
+            return utils.write_export(sys.stdout, rows, fmt)
+    with tracing.phase("render"):
+        report.render(sys.stdout)
+        print()
 
 
 main()
@@ -1,15 +1,14 @@
 #!/usr/local/bin/python
 
-import os
-import json
-import commands
+import subprocess
 
 import utils
+import tracking
 
 
-tracked = json.loads(commands.getoutput('timew get dom.tracked.1.json'))
-if 'end' in tracked:
-    print 'There is no active time tracking.'
+tracked = tracking.current()
+if not tracked or 'end' in tracked:
+    print('There is no active time tracking.')
     exit()
 
 tags = tracked['tags']
@@ -18,4 +17,7 @@ for tag in utils.format_inputs()[0]['temp']['report']['tags'].split(','):
         tag = tag[1:-1]
     (tags.remove if tag in tags else tags.append)(tag)
 
-os.system('timew start %s' % ' '.join('"%s"' % tag for tag in tags))
+if subprocess.run(['timew', 'start'] + tags).returncode:
+    tracking.invalidate()
+else:
+    tracking.refresh()
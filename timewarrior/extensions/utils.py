@@ -1,9 +1,14 @@
 import re
 import os
+import array
+import mmap
 import sys
+import bisect
 import json
 import time
 import datetime
+import itertools
+import collections
 
 
 basedir = os.path.realpath(__file__)
@@ -12,10 +17,18 @@ for i in range(3):
 if basedir not in sys.path:
     sys.path.append(basedir)
 import settings
+import tracing
+from cache import JrnlCache, RollupCache, TaskCache, task_data_signature
 
 
 DURATION_PATTERN = re.compile(
     r'^P(\d+Y)?(\d+M)?(\d+D)?(?:T(\d+H)?(\d+M)?(\d+S)?)?$')
+# `[2018-01-01 09:00] Title` or `2018-01-01 09:00:00 AM Title`
+JRNL_HEADER_PATTERN = re.compile(
+    r'^\[?(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d)(?::(\d\d))?'
+    r'(?: ([AP]M))?\]? ?(.*)$')
+UUID_PATTERN = re.compile(
+    r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
 
 
 def parse_duration(duration):
@@ -26,6 +39,7 @@ def parse_duration(duration):
     return datetime.timedelta(seconds=s)
 
 
+@tracing.traced('parse_utc', aggregate=True)
 def parse_utc(utcdate):
     return (
         datetime.datetime.strptime(utcdate, '%Y%m%dT%H%M%SZ') -
@@ -36,7 +50,38 @@ def utc2tz(utcdate):
     return parse_utc(utcdate).strftime('%Y-%m-%dT%H:%M:%S')
 
 
-def format_inputs():
+EPOCH = datetime.datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+_day_seconds = {}
+
+
+@tracing.traced('parse_epoch', aggregate=True)
+def parse_epoch(utcdate):
+    '''Seconds since the epoch of a date like 20180101T000000Z'''
+    day = utcdate[:8]
+    seconds = _day_seconds.get(day)
+    if seconds is None:
+        seconds = _day_seconds[day] = 86400 * (datetime.date(
+            int(day[:4]), int(day[4:6]), int(day[6:])
+        ).toordinal() - EPOCH_ORDINAL)
+    return (
+        seconds + int(utcdate[9:11]) * 3600 + int(utcdate[11:13]) * 60 +
+        int(utcdate[13:15]))
+
+
+def epoch2local(seconds):
+    '''The same local datetime as parse_utc gives'''
+    return EPOCH + datetime.timedelta(seconds=seconds - time.timezone)
+
+
+@tracing.traced('format_inputs')
+def format_inputs(stream=False):
+    '''
+    Parse the configs and the intervals which timewarrior feeds extensions.
+
+    With `stream` the intervals are yielded one by one while being read,
+    instead of being loaded in a list at once.
+    '''
     configs = {}
     while 1:
         line = sys.stdin.readline()
@@ -47,9 +92,568 @@ def format_inputs():
         for k in ks[:-1]:
             c = c.setdefault(k, {})
         c[ks[-1]] = v.strip()
+    if stream:
+        return configs, iter_json_array(sys.stdin)
     return configs, json.load(sys.stdin)
 
 
+def skip_inputs():
+    '''Read the rest of the intervals fed by timewarrior without parsing'''
+    while sys.stdin.buffer.read(65536):
+        pass
+
+
+@tracing.traced('taskopen_jrnl', aggregate=True)
+def taskopen_jrnl(uuid, from_date, to_date):
+    import subprocess
+
+    jrnl_args = '--short -from %s -to %s' % (from_date, to_date)
+    command = 'taskopen jrnl --args="%s" --active-tasks="" %s' % (
+        jrnl_args, uuid)
+    jrnl_logs = subprocess.run(
+        command,
+        shell=True,
+        encoding='utf-8',
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL)
+    if jrnl_logs.stdout == 'No actions applicable.\n':
+        return ''
+    return jrnl_logs.stdout
+
+
+def jrnl_key(uuid, from_date, to_date):
+    return (
+        uuid, from_date.strftime('%Y-%m-%dT%H:%M'),
+        to_date.strftime('%Y-%m-%dT%H:%M:%S'))
+
+
+class JrnlIndex:
+    '''
+    Entries of a jrnl journal mentioning task uuids, read in a single scan
+    of the journal file and sorted by time for every uuid.
+    '''
+
+    def __init__(self, path):
+        entries = collections.defaultdict(list)
+        date = title = None
+        uuids = set()
+        with open(path, encoding='utf-8') as journal:
+            for line in journal:
+                match = JRNL_HEADER_PATTERN.match(line)
+                if match:
+                    for uuid in uuids:
+                        entries[uuid].append((date, title))
+                    date, title = self.parse_header(match)
+                    uuids = set()
+                if date:
+                    uuids.update(UUID_PATTERN.findall(line))
+        for uuid in uuids:
+            entries[uuid].append((date, title))
+        self.entries = {}
+        for uuid, logs in entries.items():
+            logs.sort()
+            self.entries[uuid] = ([log[0] for log in logs], logs)
+
+    @staticmethod
+    def parse_header(match):
+        y, m, d, H, M, S, ampm, title = match.groups()
+        H = int(H) % 12 + (12 if ampm == 'PM' else 0) if ampm else int(H)
+        date = datetime.datetime(
+            int(y), int(m), int(d), H, int(M), int(S or 0))
+        return date, title.strip()
+
+    def logs(self, uuid, from_date, to_date):
+        '''Like `jrnl --short -from <from_date> -to <to_date>`'''
+        if uuid not in self.entries:
+            return None
+        dates, logs = self.entries[uuid]
+        from_date = from_date.replace(second=0, microsecond=0)
+        lo = bisect.bisect_left(dates, from_date)
+        hi = bisect.bisect_right(dates, to_date)
+        return ''.join(
+            '%s %s\n' % (date.strftime('%Y-%m-%d %H:%M'), title)
+            for date, title in logs[lo:hi]
+        ) or None
+
+
+@tracing.traced('iter_jrnl_logs')
+def iter_jrnl_logs(queries):
+    '''
+    Yield in order the logs of jrnl (or None) for each
+    (uuid, from_date, to_date) in `queries`.
+
+    With settings.JRNL_JOURNAL the journal is indexed once and searched
+    directly. Otherwise cached logs are yielded at once, and the others are
+    asked from taskopen by a pool of threads working on the queries ahead.
+    Queries ending in the last minute, like the ones of an open interval
+    ending now, are never cached, as they are not asked the same again.
+    '''
+    if settings.JRNL_JOURNAL:
+        index = JrnlIndex(os.path.expanduser(settings.JRNL_JOURNAL))
+        for query in queries:
+            yield index.logs(*query)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache, window = JrnlCache(), collections.deque()
+    recent = epoch2local(int(time.time()) - 60)
+
+    def pop():
+        key, logs, cached = window.popleft()
+        if not isinstance(logs, str):
+            logs = logs.result()
+            if cached:
+                cache.put(key, logs)
+        return logs or None
+
+    with ThreadPoolExecutor(settings.JRNL_WORKERS) as executor:
+        for query in queries:
+            key, cached = jrnl_key(*query), query[2] < recent
+            logs = cache.get(key) if cached else None
+            if logs is None:
+                logs = executor.submit(taskopen_jrnl, *key)
+            window.append((key, logs, cached))
+            if len(window) > settings.JRNL_WORKERS * 4:
+                yield pop()
+        while window:
+            yield pop()
+
+
+def jrnl_logs(uuid, from_date, to_date):
+    return next(iter_jrnl_logs([(uuid, from_date, to_date)]))
+
+
 def is_uuid(s):
     '269795eb-57a4-46d0-b636-4d2ff5ad5c49'
     return len(s) == 36 and s.count('-') == 4
+
+
+DATA_FILE_PATTERN = re.compile(r'^(\d{4})-(\d\d)\.data$')
+DATA_LINE_PATTERN = re.compile(
+    rb'^inc (\d{8}T\d{6}Z)(?: - (\d{8}T\d{6}Z))?(?: # ([^\n]*))?$', re.M)
+DATA_TAG_PATTERN = re.compile(rb'"((?:[^"\\]|\\.)*)"|(\S+)')
+
+
+def data_dir(configs):
+    '''The data folder of the database timewarrior runs the extension on'''
+    db = configs.get('temp', {}).get('db')
+    return os.path.join(db or settings.TIMEWARRIOR_DB, 'data')
+
+
+def data_files(start=None, end=None, datadir=None):
+    '''
+    Paths of the monthly data files of timewarrior which may hold intervals
+    overlapping [start, end), given in seconds since the epoch.
+
+    The month before `start` is included for the intervals crossing months.
+    '''
+    datadir = datadir or os.path.join(settings.TIMEWARRIOR_DB, 'data')
+    first = last = None
+    if start is not None:
+        first = time.gmtime(start)
+        first = (first.tm_year * 12 + first.tm_mon - 2)
+    if end is not None:
+        last = time.gmtime(end - 1)
+        last = (last.tm_year * 12 + last.tm_mon - 1)
+    try:
+        names = sorted(os.listdir(datadir))
+    except FileNotFoundError:
+        return []
+    paths = []
+    for name in names:
+        match = DATA_FILE_PATTERN.match(name)
+        if not match:
+            continue
+        month = int(match.group(1)) * 12 + int(match.group(2)) - 1
+        if first is not None and month < first:
+            continue
+        if last is None or month <= last:
+            paths.append(os.path.join(datadir, name))
+    return paths
+
+
+def parse_data_tags(tags):
+    '''Tags after `#` in a data line, up to the annotation if there is one'''
+    ret = []
+    for match in DATA_TAG_PATTERN.finditer(tags):
+        quoted, word = match.groups()
+        if word == b'#':
+            break
+        if quoted is None:
+            ret.append(word.decode('utf-8'))
+        else:
+            ret.append(re.sub(rb'\\(.)', rb'\1', quoted).decode('utf-8'))
+    return ret
+
+
+@tracing.traced('iter_data_intervals')
+def iter_data_intervals(start=None, end=None, datadir=None):
+    '''
+    Yield (start, end, tags) of the intervals overlapping [start, end) read
+    from the data files of timewarrior, with `end` None if still open.
+
+    The files are memory-mapped and lines are matched in place.
+    '''
+    for path in data_files(start, end, datadir):
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                continue
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for match in DATA_LINE_PATTERN.finditer(mm):
+                    since, until, tags = match.groups()
+                    since = parse_epoch(since.decode('ascii'))
+                    until = until and parse_epoch(until.decode('ascii'))
+                    if end is not None and since >= end:
+                        continue
+                    if start is not None and until and until <= start:
+                        continue
+                    yield since, until, parse_data_tags(tags) if tags else []
+
+
+DAY_SECONDS = 86400
+
+
+def data_file_stats(datadir=None):
+    '''Map the months of the data files, counted from year 0, to their state'''
+    datadir = datadir or os.path.join(settings.TIMEWARRIOR_DB, 'data')
+    stats = {}
+    try:
+        names = os.listdir(datadir)
+    except FileNotFoundError:
+        return stats
+    for name in names:
+        match = DATA_FILE_PATTERN.match(name)
+        if match:
+            st = os.stat(os.path.join(datadir, name))
+            month = int(match.group(1)) * 12 + int(match.group(2)) - 1
+            stats[month] = '%s:%d:%d' % (name, st.st_mtime_ns, st.st_size)
+    return stats
+
+
+def data_signature(stats, start, end):
+    '''
+    What changes along with the intervals within [start, end): the state of
+    the data files data_files would read for them, and the timezone
+    '''
+    first, last = time.gmtime(start), time.gmtime(end - 1)
+    return ' '.join(['%d' % time.timezone] + [
+        stats[month] for month in range(
+            first.tm_year * 12 + first.tm_mon - 2,
+            last.tm_year * 12 + last.tm_mon)
+        if month in stats])
+
+
+def sum_days(days, start, end, now, datadir=None):
+    '''
+    Sum up the intervals of the data files by task within the local `days`,
+    consecutive ones given by number, cut to [start, end). Returns the
+    sums by day and the days with an open interval.
+    '''
+    sums = dict((day, {}) for day in days)
+    opened = set()
+    since = max(start, days[0] * DAY_SECONDS + time.timezone)
+    until = min(end, (days[-1] + 1) * DAY_SECONDS + time.timezone)
+    for first, last, tags in iter_data_intervals(since, until, datadir):
+        is_open = last is None
+        first, last = max(first, since), min(now if is_open else last, until)
+        uuid = next((tag for tag in tags if is_uuid(tag)), '')
+        pomodoro = settings.POMODORO_TAG in tags
+        while first < last:
+            day = (first - time.timezone) // DAY_SECONDS
+            stop = min(last, (day + 1) * DAY_SECONDS + time.timezone)
+            row = sums[day].setdefault(uuid, [0, 0])
+            row[0] += stop - first
+            if pomodoro:
+                row[1] += stop - first
+            if is_open:
+                opened.add(day)
+            first = stop
+    return sums, opened
+
+
+@tracing.traced('rollup')
+def rollup(start=None, end=None, now=None, datadir=None):
+    '''
+    (day, uuid, seconds, pomodoro_seconds) of the intervals within
+    [start, end) by local day, like 2018-01-01, with `end` up to `now`.
+
+    Whole days which are over are kept in the RollupCache, and only read
+    from the data files in `datadir` again when the files they come from
+    have changed.
+    '''
+    now = int(time.time()) if now is None else now
+    end = now if end is None else min(end, now)
+    stats = data_file_stats(datadir)
+    if start is None:
+        month = min(stats, default=None)
+        if month is None:
+            return []
+        start = DAY_SECONDS * (datetime.date(
+            month // 12, month % 12 + 1, 1).toordinal() - EPOCH_ORDINAL)
+    if start >= end:
+        return []
+
+    def key(day):
+        return datetime.date.fromordinal(EPOCH_ORDINAL + day).isoformat()
+
+    first = (start - time.timezone) // DAY_SECONDS
+    last = (end - 1 - time.timezone) // DAY_SECONDS
+    signatures = {}
+    for day in range(first, last + 1):
+        since = day * DAY_SECONDS + time.timezone
+        # Days cut by the range are never kept.
+        if since >= start and since + DAY_SECONDS <= end:
+            signatures[day] = data_signature(
+                stats, since, since + DAY_SECONDS)
+    cache = RollupCache()
+    cached = cache.signatures(key(day) for day in signatures)
+    missing = [
+        day for day in range(first, last + 1)
+        if day not in signatures or cached.get(key(day)) != signatures[day]]
+
+    sums, opened = {}, set()
+    for _, run in itertools.groupby(
+            enumerate(missing), lambda pair: pair[1] - pair[0]):
+        days = [day for _, day in run]
+        run_sums, run_opened = sum_days(days, start, end, now, datadir)
+        sums.update(run_sums)
+        opened.update(run_opened)
+    cache.put(dict(
+        (key(day), (signatures[day], [
+            (uuid,) + tuple(row) for uuid, row in sums[day].items()]))
+        for day in sums if day in signatures and day not in opened))
+
+    rows = cache.get(key(day) for day in signatures if day not in sums)
+    rows.extend(
+        (key(day), uuid, row[0], row[1])
+        for day in sums for uuid, row in sums[day].items())
+    rows.sort()
+    return rows
+
+
+class IntervalTable:
+    '''
+    Intervals of timewarrior stored column by column.
+
+    Starts and ends are seconds since the epoch, and open intervals end at
+    `now`. Tags are interned into integer ids, and the id of the uuid tag of
+    each interval is found once when it is added (-1 if there is none).
+    '''
+
+    def __init__(self, now=None):
+        self.now = int(time.time()) if now is None else now
+        self.starts = array.array('q')
+        self.ends = array.array('q')
+        self.opened = bytearray()
+        self.uuid_ids = array.array('l')
+        # Tag ids of the i-th interval are the ones in tag_ids between
+        # tag_offsets[i] and tag_offsets[i + 1].
+        self.tag_ids = array.array('l')
+        self.tag_offsets = array.array('q', [0])
+        self.tags, self.tag_index, self.uuid_tags = [], {}, bytearray()
+
+    @classmethod
+    def from_entries(cls, entries, now=None):
+        table = cls(now)
+        for entry in entries:
+            table.append(entry)
+        return table
+
+    def __len__(self):
+        return len(self.starts)
+
+    def intern(self, tag):
+        tid = self.tag_index.get(tag)
+        if tid is None:
+            tid = self.tag_index[tag] = len(self.tags)
+            self.tags.append(tag)
+            self.uuid_tags.append(is_uuid(tag))
+        return tid
+
+    def append(self, entry):
+        self.add(
+            parse_epoch(entry['start']),
+            parse_epoch(entry['end']) if 'end' in entry else None,
+            entry['tags'])
+
+    def add(self, start, end, tags):
+        '''Add an interval, which is open if `end` is None'''
+        self.starts.append(start)
+        if end is not None:
+            self.ends.append(end)
+            self.opened.append(0)
+        else:
+            self.ends.append(self.now)
+            self.opened.append(1)
+        uuid_id = -1
+        for tag in tags:
+            tid = self.intern(tag)
+            self.tag_ids.append(tid)
+            if uuid_id < 0 and self.uuid_tags[tid]:
+                uuid_id = tid
+        self.uuid_ids.append(uuid_id)
+        self.tag_offsets.append(len(self.tag_ids))
+
+    def tags_of(self, i):
+        offsets = self.tag_offsets
+        return [
+            self.tags[tid] for tid in self.tag_ids[offsets[i]:offsets[i + 1]]]
+
+    def uuid(self, i):
+        tid = self.uuid_ids[i]
+        return self.tags[tid] if tid >= 0 else None
+
+    def uuids(self):
+        return set(self.tags[tid] for tid in set(self.uuid_ids) if tid >= 0)
+
+
+@tracing.traced('iter_json_array')
+def iter_json_array(stream, bufsize=65536):
+    '''Yield the items of a JSON array read from `stream` one by one'''
+    decoder, buf, pos = json.JSONDecoder(), '', 0
+    opened = exhausted = False
+    while 1:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buf) and not opened:
+            assert buf[pos] == '[', 'not a JSON array: %r' % buf[pos:pos + 20]
+            opened, pos = True, pos + 1
+            continue
+        if pos < len(buf) and buf[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            chunk = '' if exhausted else stream.read(bufsize)
+            if not chunk:
+                assert not opened or pos >= len(buf), 'truncated JSON array'
+                return
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        # A number cut at the end of the buffer, like `45.` or `3e+`, is
+        # decoded as a shorter one leaving up to 2 characters behind.
+        if (not exhausted and len(buf) - end <= 2 and
+                not isinstance(item, (dict, list, str))):
+            chunk = stream.read(bufsize)
+            exhausted = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        yield item
+        pos = end
+
+
+def export_tasks(uuids):
+    '''Export the tasks of `uuids` with a single call of `task`'''
+    import subprocess
+
+    proc = subprocess.Popen(
+        ['task', 'rc.hooks=off'] + list(uuids) + ['export'],
+        encoding='utf-8',
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL)
+    with proc.stdout:
+        tasks = list(iter_json_array(proc.stdout))
+    proc.wait()
+    return tasks
+
+
+@tracing.traced('export_tasks_batched')
+def export_tasks_batched(uuids):
+    '''
+    Export the tasks of `uuids` in chunks of settings.EXPORT_CHUNK_SIZE
+    to keep the command lines short, with the chunks exported in parallel
+    '''
+    uuids = sorted(uuids)
+    chunks = [
+        uuids[i:i + settings.EXPORT_CHUNK_SIZE]
+        for i in range(0, len(uuids), settings.EXPORT_CHUNK_SIZE)]
+    if len(chunks) < 2:
+        return export_tasks(uuids) if uuids else []
+    from concurrent.futures import ThreadPoolExecutor
+
+    workers = min(len(chunks), settings.EXPORT_WORKERS)
+    with ThreadPoolExecutor(workers) as executor:
+        return [
+            task for tasks in executor.map(export_tasks, chunks)
+            for task in tasks]
+
+
+@tracing.traced('load_tasks')
+def load_tasks(uuids):
+    '''
+    Map `uuids` to their tasks, exporting only the ones not cached since the
+    data files of taskwarrior last changed
+    '''
+    uuids = set(uuids)
+    cache = TaskCache()
+    generation = cache.generation(task_data_signature())
+    tasks = cache.get(uuids, generation)
+    missing = uuids.difference(tasks)
+    if missing:
+        exported = export_tasks_batched(missing)
+        cache.put(exported, generation)
+        tasks.update((task['uuid'], task) for task in exported)
+    return tasks
+
+
+EXPORT_COLUMNS = (
+    'start', 'end', 'seconds', 'uuid', 'project', 'description', 'status',
+    'pomodoro')
+EXPORT_FORMATS = ('jsonl', 'csv')
+
+
+def export_format(configs, report):
+    '''
+    The format of rc.reports.<report>.format to export rows in, or None
+    for the report in text
+    '''
+    fmt = configs.get('reports', {}).get(report, {}).get('format', '')
+    fmt = fmt.lower()
+    if not fmt or fmt == 'text':
+        return None
+    assert fmt in EXPORT_FORMATS, 'not a format to export in: %s' % fmt
+    return fmt
+
+
+def iter_export_rows(table, tasks):
+    '''
+    Yield the intervals of `table` joined with their `tasks` one by one,
+    where open intervals have no end and last until `table.now`
+    '''
+    def utc(seconds):
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+    for i in range(len(table)):
+        uuid, tags = table.uuid(i), table.tags_of(i)
+        task = tasks.get(uuid) or {}
+        yield {
+            'start': utc(table.starts[i]),
+            'end': None if table.opened[i] else utc(table.ends[i]),
+            'seconds': table.ends[i] - table.starts[i],
+            'uuid': uuid,
+            'project': task.get('project'),
+            'description': task.get('description') or ', '.join(tags),
+            'status': task.get('status'),
+            'pomodoro': settings.POMODORO_TAG in tags,
+        }
+
+
+def write_export(out, rows, fmt):
+    '''Write `rows` to `out` as JSON Lines or CSV while they come'''
+    if fmt == 'csv':
+        import csv
+
+        writer = csv.DictWriter(out, EXPORT_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(row):
+            out.write(json.dumps(row, ensure_ascii=False) + '\n')
+    try:
+        for row in rows:
+            write(row)
+        out.flush()
+    except BrokenPipeError:
+        # The reader, like `head`, has had enough.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), out.fileno())
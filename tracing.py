@@ -0,0 +1,244 @@
+'''
+Opt-in tracing of the hooks and extensions, switched on by the environment:
+
+    POMODORO_TRACE=/tmp/pomodoro.jsonl task 1 done
+    POMODORO_TRACE=/tmp/pomodoro.json timew week
+
+Phases of the shared utils, hot functions and every external command with
+its duration and output size are appended to the file, as JSON lines or as
+Chrome trace events (for chrome://tracing or Perfetto) when the file name
+ends with `.json`. When the switch is off nothing is patched or wrapped.
+'''
+
+import os
+import sys
+import time
+
+import settings
+
+
+ENABLED = bool(settings.TRACE_PATH)
+_events = []
+_started = time.time()
+# name -> [calls, seconds] of functions too hot to trace call by call
+_totals = {}
+
+
+def _record(name, cat, start, seconds, **args):
+    _events.append({
+        'name': name,
+        'cat': cat,
+        'ts': start,
+        'dur': seconds,
+        'pid': os.getpid(),
+        'args': args,
+    })
+
+
+def _process_start():
+    '''When the interpreter started, which is before Python code runs'''
+    try:
+        with open('/proc/self/stat') as f:
+            ticks = int(f.read().rpartition(')')[2].split()[19])
+        uptime = time.clock_gettime(time.CLOCK_BOOTTIME)
+    except (OSError, ValueError, AttributeError):
+        return None
+    return time.time() - uptime + ticks / os.sysconf('SC_CLK_TCK')
+
+
+def traced(name, aggregate=False):
+    '''
+    Time every call of the decorated function as a phase, or only sum the
+    calls up with `aggregate`. Generators are timed while producing items.
+    '''
+    def decorator(func):
+        if not ENABLED:
+            return func
+        import functools
+
+        if aggregate:
+            _totals.setdefault(name, [0, 0.0])
+        if func.__code__.co_flags & 0x20:  # A generator function
+            @functools.wraps(func)
+            def generator(*args, **kwargs):
+                it, total = func(*args, **kwargs), _totals.get(name)
+                seconds, items, start = 0.0, 0, time.time()
+                while 1:
+                    t = time.perf_counter()
+                    try:
+                        item = next(it)
+                    except StopIteration:
+                        break
+                    finally:
+                        seconds += time.perf_counter() - t
+                    items += 1
+                    yield item
+                if total:
+                    total[0] += items
+                    total[1] += seconds
+                else:
+                    _record(name, 'phase', start, seconds, items=items)
+            return generator
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start, t = time.time(), time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - t
+                if aggregate:
+                    _totals[name][0] += 1
+                    _totals[name][1] += seconds
+                else:
+                    _record(name, 'phase', start, seconds)
+        return wrapper
+    return decorator
+
+
+class _Phase:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start, self.t = time.time(), time.perf_counter()
+
+    def __exit__(self, *exc):
+        _record(self.name, 'phase', self.start, time.perf_counter() - self.t)
+
+
+class _NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    '''A `with` block timed as a phase'''
+    return _Phase(name) if ENABLED else _NO_PHASE
+
+
+class _CountedStream:
+    '''Counts what is read from the pipe of a command'''
+
+    def __init__(self, stream, proc):
+        self._stream, self._proc = stream, proc
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._stream.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self._stream)
+        self._proc._trace_output += len(line)
+        return line
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self._proc._trace_output += len(data)
+        return data
+
+    def readline(self, *args):
+        line = self._stream.readline(*args)
+        self._proc._trace_output += len(line)
+        return line
+
+
+def _traced_popen(base):
+    class Popen(base):
+        def __init__(self, args, *rest, **kwargs):
+            self._trace_start = time.time()
+            self._trace_clock = time.perf_counter()
+            self._trace_output = 0
+            self._trace_deferred = self._trace_done = False
+            super().__init__(args, *rest, **kwargs)
+            if self.stdout is not None:
+                self.stdout = _CountedStream(self.stdout, self)
+
+        def _trace(self):
+            if self._trace_done or self.returncode is None:
+                return
+            self._trace_done = True
+            argv = self.args
+            if isinstance(argv, (str, bytes)):
+                argv = os.fsdecode(argv).split()
+            argv = [os.fsdecode(arg) for arg in argv]
+            _record(
+                ' '.join(argv[:2]), 'command', self._trace_start,
+                time.perf_counter() - self._trace_clock,
+                argv=argv, returncode=self.returncode,
+                output=self._trace_output)
+
+        def wait(self, *args, **kwargs):
+            try:
+                return super().wait(*args, **kwargs)
+            finally:
+                if not self._trace_deferred:
+                    self._trace()
+
+        def communicate(self, *args, **kwargs):
+            # communicate() reads the pipe itself, so count what it returns.
+            if isinstance(self.stdout, _CountedStream):
+                self.stdout = self.stdout._stream
+            self._trace_deferred = True
+            try:
+                outs = super().communicate(*args, **kwargs)
+            finally:
+                self._trace_deferred = False
+            self._trace_output += sum(len(o) for o in outs if o)
+            self._trace()
+            return outs
+
+    return Popen
+
+
+def _write():
+    import json
+
+    for name, (calls, seconds) in _totals.items():
+        if calls:
+            _record(name, 'total', _started, seconds, calls=calls)
+    chrome = settings.TRACE_PATH.endswith('.json')
+    with open(settings.TRACE_PATH, 'a') as f:
+        # A Chrome trace may leave its array unclosed, so that processes
+        # can append their events to the same file.
+        if chrome and not f.tell():
+            f.write('[\n')
+        for event in _events:
+            if chrome:
+                event = dict(
+                    event, ph='X', tid=event['pid'],
+                    ts=int(event['ts'] * 1e6), dur=int(event['dur'] * 1e6))
+                f.write(json.dumps(event) + ',\n')
+            else:
+                f.write(json.dumps(event) + '\n')
+
+
+def enable():
+    import atexit
+    import subprocess
+
+    started = _process_start()
+    if started:
+        _record(
+            'startup', 'phase', started, _started - started,
+            argv=sys.argv)
+    subprocess.Popen = _traced_popen(subprocess.Popen)
+    atexit.register(_write)
+
+
+if ENABLED:
+    enable()
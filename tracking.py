@@ -0,0 +1,91 @@
+'''
+The interval tracked last by timewarrior, shared by the hooks and extensions
+in a state file so that they don't have to ask `timew` for it every time.
+
+The state is what `timew get dom.tracked.1.json` gives, without `end` while
+tracking. It is trusted as long as it is newer than the data of timewarrior,
+which changes whenever tracking is started or stopped, by us or not.
+'''
+
+import os
+import json
+import time
+
+import settings
+
+
+STATE_PATH = os.path.join(settings.CACHE_DIR, 'tracking.json')
+
+
+def data_mtime():
+    '''Latest change of the data files timewarrior writes when tracking'''
+    datadir = os.path.join(settings.TIMEWARRIOR_DB, 'data')
+    year, month = time.gmtime()[:2]
+    last = (year, month - 1) if month > 1 else (year - 1, 12)
+    mtime = 0
+    for name in ('undo.data', '%04d-%02d.data' % (year, month),
+                 '%04d-%02d.data' % last):
+        try:
+            mtime = max(mtime, os.stat(os.path.join(datadir, name)).st_mtime)
+        except OSError:
+            pass
+    return mtime
+
+
+def read():
+    '''The last tracked interval, or None if the state is missing or stale'''
+    try:
+        with open(STATE_PATH) as f:
+            if os.fstat(f.fileno()).st_mtime < data_mtime():
+                return None
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write(tracked):
+    os.makedirs(settings.CACHE_DIR, exist_ok=True)
+    tmp = '%s.%s' % (STATE_PATH, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(tracked, f)
+    os.replace(tmp, STATE_PATH)
+
+
+def refresh():
+    '''Ask timewarrior for the last tracked interval and keep it'''
+    import subprocess
+
+    output = subprocess.run(
+        ['timew', 'get', 'dom.tracked.1.json'],
+        encoding='utf-8',
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL)
+    try:
+        tracked = json.loads(output.stdout)
+    except ValueError:
+        # Nothing has been tracked yet.
+        tracked = {}
+    write(tracked)
+    return tracked
+
+
+def current():
+    '''The last tracked interval, from the state if it is up to date'''
+    tracked = read()
+    return refresh() if tracked is None else tracked
+
+
+def now():
+    return time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+
+
+def stopped(tracked):
+    '''Keep that `tracked`, the interval being tracked, has just ended'''
+    write(dict(tracked, end=now()))
+
+
+def invalidate():
+    try:
+        os.remove(STATE_PATH)
+    except FileNotFoundError:
+        pass